@@ -57,11 +57,18 @@ INSTALLED_APPS = [
 SITE_ID = 1
 
 CART_SESSION_ID = 'cart'
+# Cart backend, see cart.storage
+CART_STORAGE = os.getenv('CART_STORAGE', 'cart.storage.SignedCookieCartStorage')
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_AGE = 60 * 60 * 24 * 30
+# How long checkout holds a cart's stock, see orders.services.reserve_stock
+STOCK_RESERVATION_MINUTES = 10
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
+    "cart.middleware.CartStorageMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
@@ -84,6 +91,7 @@ TEMPLATES = [
                 "django.contrib.messages.context_processors.messages",
                 "cart.context_processors.cart",
                 "products.context_processors.categories_processor",
+                "core.context_processors.page_cache",
             ],
         },
     },
@@ -112,6 +120,24 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Catalog version counters live here, so use a shared backend (Redis or
+# Memcached) when running more than one worker process.
+
+# Production needs a cache shared by all workers (Redis, see .env.example):
+# catalog versions, page purges and cache-stored carts live here (core.checks)
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv('CACHE_BACKEND', "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Shared full-page cache for anonymous visitors (see core.page_cache)
+PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', 'True') == 'True'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -154,6 +180,14 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 # Media files (User uploads)
 MEDIA_URL = "media/"
 MEDIA_ROOT = BASE_DIR / "media"
+# Size cap of the on-demand resize cache, see core.media_resize
+MEDIA_RESIZE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# The only (width, height) boxes it renders: the admin previews
+MEDIA_RESIZE_SIZES = [(240, 120), (200, 200), (160, 160)]
+
+# Generated sitemap files, see core.sitemap_files
+SITEMAP_ROOT = BASE_DIR / "sitemaps"
+SITEMAP_PROTOCOL = "https"
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -27,18 +27,9 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from django.contrib.sitemaps.views import sitemap
 from django.views.generic.base import TemplateView
-from products.sitemaps import ProductSitemap, CategorySitemap
-from core.sitemaps import StaticViewSitemap
 
-sitemaps = {
-    'products': ProductSitemap,
-    'categories': CategorySitemap,
-    'static': StaticViewSitemap,
-}
-
-from core.views import robots_txt
+from core.views import robots_txt, sitemap_index, sitemap_section
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -49,7 +40,8 @@ urlpatterns = [
     path('', include('pages.urls')),
     
     # SEO
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+    path('sitemap.xml', sitemap_index, name='sitemap_index'),
+    path('sitemap-<slug:section>.xml', sitemap_section, name='sitemap_section'),
     path('robots.txt', robots_txt),
 ]
 
@@ -1,6 +1,33 @@
+import atexit
+import logging
+
 from django.apps import AppConfig
+from django.core.signals import request_finished
+from django.db import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+
+def _flush_due_carts(sender, **kwargs):
+    from .storage import write_behind
+
+    write_behind.flush(if_due=True)
+
+
+def _flush_carts():
+    from .storage import write_behind
+
+    try:
+        write_behind.flush()
+    except DatabaseError:
+        logger.exception("Could not persist buffered carts at exit")
 
 
 class CartConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "cart"
+
+    def ready(self):
+        # Cart writes buffered by CacheCartStorage (see cart.storage)
+        request_finished.connect(_flush_due_carts, dispatch_uid='cart.flush_due_carts')
+        atexit.register(_flush_carts)
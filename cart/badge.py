@@ -0,0 +1,17 @@
+from functools import lru_cache
+
+from django.utils.html import format_html
+
+BADGE_HTML = (
+    '<span class="absolute top-0 right-0 inline-flex items-center justify-center px-2 py-1 '
+    'text-xs font-bold leading-none text-white transform translate-x-1/4 -translate-y-1/4 '
+    'bg-primary-600 rounded-full">{}</span>'
+)
+
+
+@lru_cache(maxsize=256)
+def render_badge(count):
+    """The navbar cart badge, pre-rendered; empty for an empty cart"""
+    if count <= 0:
+        return ''
+    return format_html(BADGE_HTML, count)
@@ -1,98 +1,105 @@
 from decimal import Decimal
-from django.conf import settings
 from products.models import Product, ProductVariant
+from .storage import get_cart_storage
+
+
+def _to_id(value):
+    """Parse an id posted by the cart forms ('' or 'None' for no variant)"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
 
 class Cart:
     def __init__(self, request):
         """Initialize the cart"""
-        self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            # Save an empty cart in the session
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        self.storage = get_cart_storage(request)
+        # (product_id, variant_id) -> quantity
+        self.lines = dict(self.storage.load())
+        # Resolved lines, built on first iteration and dropped on mutation
+        self._items = None
 
     def add(self, product, quantity=1, variant=None, update_quantity=False):
         """Add a product to the cart or update its quantity"""
-        product_id = str(product.id)
-        
-        # Create a unique key for the item (Product ID + Variant ID)
-        item_key = product_id
-        if variant:
-            item_key = f"{product_id}_{variant.id}"
-            
-        if item_key not in self.cart:
-            self.cart[item_key] = {
-                'quantity': 0,
-                'price': str(product.base_price),
-                'product_id': product.id,
-                'variant_id': variant.id if variant else None,
-            }
-            
+        # One line per product and variant combination
+        key = (product.id, variant.id if variant else None)
+
         if update_quantity:
-            self.cart[item_key]['quantity'] = quantity
+            self.lines[key] = quantity
         else:
-            self.cart[item_key]['quantity'] += quantity
-            
+            self.lines[key] = self.lines.get(key, 0) + quantity
+
         self.save()
 
     def save(self):
-        """Mark the session as modified to ensure it gets saved"""
-        self.session.modified = True
+        """Write the cart back to its storage"""
+        self._items = None
+        self.storage.save(dict(self.lines))
 
     def remove(self, product_id, variant_id=None):
         """Remove a product from the cart"""
-        item_key = str(product_id)
-        if variant_id:
-            item_key = f"{product_id}_{variant_id}"
-            
-        if item_key in self.cart:
-            del self.cart[item_key]
+        key = (_to_id(product_id), _to_id(variant_id))
+        if key in self.lines:
+            del self.lines[key]
             self.save()
 
-    def __iter__(self):
-        """Iterate over the items in the cart and get the products from the database"""
-        cart = self.cart.copy()
-        
-        # We need to fetch products and variants to display them
-        # Group by product IDs to minimize queries, though loop is simpler for now
-        # Ideally we'd optimize this, but for session cart it's okay.
-        
-        for item_key, item in cart.items():
-            item = item.copy()
-            product_id = item['product_id']
-            variant_id = item.get('variant_id')
-            
-            # Fetch product (could be optimized)
-            try:
-                product = Product.objects.get(id=product_id)
-                item['product'] = product
-            except Product.DoesNotExist:
+    def update_lines(self, quantities):
+        """Set the quantities of several existing lines with a single write;
+        a quantity below one removes the line"""
+        changed = False
+        for key, quantity in quantities.items():
+            if key not in self.lines or self.lines[key] == quantity:
                 continue
-                
-            if variant_id:
-                try:
-                    variant = ProductVariant.objects.get(id=variant_id)
-                    item['variant'] = variant
-                except ProductVariant.DoesNotExist:
-                    item['variant'] = None
+            if quantity > 0:
+                self.lines[key] = quantity
             else:
-                item['variant'] = None
-                
-            item['price'] = Decimal(item['price'])
-            item['total_price'] = item['price'] * item['quantity']
-            
-            yield item
+                del self.lines[key]
+            changed = True
+        if changed:
+            self.save()
+
+    def _resolve(self):
+        """Resolve every line with one query for products (plus one for their
+        primary images) and one for variants, whatever the cart size"""
+        product_ids = {product_id for product_id, _ in self.lines}
+        variant_ids = {variant_id for _, variant_id in self.lines if variant_id}
+        products = Product.objects.for_cards().in_bulk(product_ids) if product_ids else {}
+        variants = ProductVariant.objects.in_bulk(variant_ids) if variant_ids else {}
+
+        items = []
+        for (product_id, variant_id), quantity in self.lines.items():
+            product = products.get(product_id)
+            if product is None:
+                continue
+            price = Decimal(product.price)
+            items.append({
+                'product_id': product_id,
+                'variant_id': variant_id,
+                'quantity': quantity,
+                'product': product,
+                'variant': variants.get(variant_id),
+                'price': price,
+                'total_price': price * quantity,
+            })
+        return items
+
+    def __iter__(self):
+        """Iterate over the items in the cart with their products and variants"""
+        if self._items is None:
+            self._items = self._resolve()
+        return iter(self._items)
 
     def __len__(self):
         """Count all items in the cart"""
-        return sum(item['quantity'] for item in self.cart.values())
+        return sum(self.lines.values())
 
     def get_total_price(self):
         """Calculate total cost"""
-        return sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
+        return sum((item['total_price'] for item in self), Decimal('0'))
 
     def clear(self):
-        """Remove cart from session"""
-        del self.session[settings.CART_SESSION_ID]
-        self.save()
+        """Empty the cart"""
+        if self.lines:
+            self.lines = {}
+            self.save()
@@ -0,0 +1,12 @@
+class CartStorageMiddleware:
+    """Let cookie-based cart storage write its cookie on the way out"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        storage = getattr(request, '_cart_storage', None)
+        if storage is not None and storage.needs_response:
+            storage.update_response(response)
+        return response
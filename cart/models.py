@@ -1,3 +1,11 @@
 from django.db import models
 
-# Create your models here.
+
+class StoredCart(models.Model):
+    """Durable copy of a cache-backed cart (see cart.storage.CacheCartStorage)"""
+    key = models.CharField(max_length=64, primary_key=True)
+    data = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,319 @@
+"""Where carts are kept between requests.
+
+A cart is a mapping of ``(product_id, variant_id) -> quantity``; prices are
+always read from the products, so nothing else needs storing. It is encoded
+compactly as ``"<product>.<variant>.<qty>"`` entries joined by commas, with
+an empty variant for products sold without one (``"12.34.2,15..1"``).
+Stored payloads carry the cart's revision in front (``"7:12.34.2"``); it
+changes on every write and lets the cart endpoints answer conditional GETs
+without resolving anything.
+
+The backend is chosen with ``settings.CART_STORAGE`` (a dotted path):
+
+* ``SignedCookieCartStorage`` keeps the cart in a signed cookie, so cart
+  reads and writes never touch the database.
+* ``CacheCartStorage`` keeps it in the cache under a random id held in a
+  signed cookie and persists it to ``StoredCart`` in write-behind batches,
+  for carts that should survive cache evictions.
+* ``SessionCartStorage`` keeps it in the session.
+
+Carts that earlier releases left in the session (a dict per line) are
+converted on first read, whatever the backend.
+
+Backends that set cookies rely on ``cart.middleware.CartStorageMiddleware``.
+"""
+import secrets
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+SIGNING_SALT = 'cart.storage'
+
+
+def encode_lines(lines):
+    return ','.join(
+        f'{product_id}.{variant_id or ""}.{quantity}'
+        for (product_id, variant_id), quantity in lines.items()
+    )
+
+
+def parse_line_key(value):
+    """Parse ``"<product>.<variant>"`` into a line key, or None"""
+    try:
+        product_id, variant_id = value.split('.')
+        return int(product_id), int(variant_id) if variant_id else None
+    except ValueError:
+        return None
+
+
+def decode_lines(value):
+    lines = {}
+    for entry in (value or '').split(','):
+        key, _, quantity = entry.rpartition('.')
+        key = parse_line_key(key)
+        try:
+            quantity = int(quantity)
+        except ValueError:
+            continue
+        if key is not None and quantity > 0:
+            lines[key] = quantity
+    return lines
+
+
+def encode_payload(revision, lines):
+    return f'{revision}:{encode_lines(lines)}'
+
+
+def decode_payload(value):
+    """Return ``(revision, lines)`` for a stored payload"""
+    if not isinstance(value, str):
+        return 0, {}
+    revision, _, lines = (value or '').rpartition(':')
+    try:
+        revision = int(revision)
+    except ValueError:
+        revision = 0
+    return revision, decode_lines(lines)
+
+
+def decode_session_cart(cart):
+    """Lines of a cart stored by earlier releases, a session dict of
+    ``{"<product>_<variant>": {"product_id": ..., "variant_id": ..., "quantity": ...}}``"""
+    lines = {}
+    for item in cart.values():
+        try:
+            key = int(item['product_id']), int(item['variant_id']) if item.get('variant_id') else None
+            quantity = int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if quantity > 0:
+            lines[key] = lines.get(key, 0) + quantity
+    return lines
+
+
+class BaseCartStorage:
+    id_cookie_name = 'cart_id'
+
+    def __init__(self, request):
+        self.request = request
+        self.modified = False
+        self.revision = 0
+        self._lines = None
+        self._cart_id = None
+        self._id_created = False
+
+    @property
+    def cart_id(self):
+        """Stable random id of the visitor's cart, or None if it has none yet"""
+        if self._cart_id is None:
+            self._cart_id = self._get_cookie(self.id_cookie_name)
+        return self._cart_id
+
+    def get_or_create_cart_id(self):
+        if not self.cart_id:
+            self._cart_id = secrets.token_urlsafe(24)
+            self._id_created = True
+        return self._cart_id
+
+    @property
+    def needs_response(self):
+        return self.modified or self._id_created
+
+    def load(self):
+        """Return the stored lines, read once per request"""
+        if self._lines is None:
+            payload = self._read()
+            if payload is None:
+                payload = self._pop_session_cart()
+            if isinstance(payload, dict):
+                # Carried over from the session cart of earlier releases
+                self.revision, self._lines = 0, {}
+                lines = decode_session_cart(payload)
+                if lines:
+                    self.save(lines)
+            else:
+                self.revision, self._lines = decode_payload(payload)
+        return self._lines
+
+    def get_revision(self):
+        """Revision of the stored cart, 0 for an empty one"""
+        self.load()
+        return self.revision
+
+    def save(self, lines):
+        self.load()
+        if not lines:
+            self.revision = 0
+        elif self.revision:
+            self.revision += 1
+        else:
+            # New carts start at a random revision, so a cart created after
+            # the cookie was cleared can't match an ETag the browser kept
+            self.revision = secrets.randbelow(1 << 30) + 1
+        self._lines = lines
+        self.modified = True
+        self._write(encode_payload(self.revision, lines) if lines else None)
+
+    def update_response(self, response):
+        """Called by the middleware for modified carts and new ids"""
+        if self._id_created:
+            self._set_cookie(response, self.id_cookie_name, self._cart_id)
+
+    def _pop_session_cart(self):
+        """Take a cart left in the session by earlier releases, if any.
+
+        Only looked up for visitors that have a session cookie, so cart
+        reads keep away from the session table otherwise.
+        """
+        session = getattr(self.request, 'session', None)
+        if session is None or settings.SESSION_COOKIE_NAME not in self.request.COOKIES:
+            return None
+        cart = session.get(settings.CART_SESSION_ID)
+        if not isinstance(cart, dict):
+            return None
+        del session[settings.CART_SESSION_ID]
+        return cart
+
+    def _read(self):
+        raise NotImplementedError
+
+    def _write(self, payload):
+        """Store ``payload``; None for an empty cart"""
+        raise NotImplementedError
+
+    def _get_cookie(self, name):
+        return self.request.get_signed_cookie(
+            name, default=None, salt=SIGNING_SALT, max_age=settings.CART_COOKIE_AGE
+        )
+
+    def _set_cookie(self, response, name, value):
+        response.set_signed_cookie(
+            name, value, salt=SIGNING_SALT,
+            max_age=settings.CART_COOKIE_AGE,
+            secure=settings.SESSION_COOKIE_SECURE,
+            httponly=True,
+            samesite='Lax',
+        )
+
+
+class SessionCartStorage(BaseCartStorage):
+    def _read(self):
+        return self.request.session.get(settings.CART_SESSION_ID)
+
+    def _write(self, payload):
+        if payload:
+            self.request.session[settings.CART_SESSION_ID] = payload
+        else:
+            self.request.session.pop(settings.CART_SESSION_ID, None)
+
+
+class SignedCookieCartStorage(BaseCartStorage):
+    def _read(self):
+        return self._get_cookie(settings.CART_COOKIE_NAME)
+
+    def _write(self, payload):
+        self._payload = payload
+
+    def update_response(self, response):
+        super().update_response(response)
+        if not self.modified:
+            return
+        if self._payload:
+            self._set_cookie(response, settings.CART_COOKIE_NAME, self._payload)
+        else:
+            response.delete_cookie(settings.CART_COOKIE_NAME, samesite='Lax')
+
+
+class WriteBehindBuffer:
+    """Pending cart payloads, persisted in one upsert per batch.
+
+    A batch is written once ``flush_every`` carts are pending or
+    ``flush_interval`` seconds have passed, so most cart writes only touch
+    the cache. Besides new writes, the end of every request and the
+    process exiting flush what is due (see cart.apps), so quiet periods
+    and restarts do not leave carts unpersisted.
+    """
+    flush_every = 50
+    flush_interval = 30
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+
+    def add(self, cart_id, data):
+        with self._lock:
+            self._pending[cart_id] = data
+        self.flush(if_due=True)
+
+    def flush(self, if_due=False):
+        """Persist the pending carts; with ``if_due``, only once a batch is due"""
+        with self._lock:
+            if not self._pending:
+                return
+            if if_due and (len(self._pending) < self.flush_every
+                           and time.monotonic() - self._last_flush < self.flush_interval):
+                return
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        self._flush(pending)
+
+    def clear(self):
+        """Drop the pending carts without persisting them"""
+        with self._lock:
+            self._pending.clear()
+
+    def _flush(self, pending):
+        from .models import StoredCart
+
+        if not pending:
+            return
+        StoredCart.objects.bulk_create(
+            [StoredCart(key=cart_id, data=data) for cart_id, data in pending.items()],
+            update_conflicts=True,
+            unique_fields=['key'],
+            update_fields=['data', 'updated_at'],
+        )
+
+
+write_behind = WriteBehindBuffer()
+
+
+class CacheCartStorage(BaseCartStorage):
+    @staticmethod
+    def _cache_key(cart_id):
+        return f'cart:{cart_id}'
+
+    def _read(self):
+        from .models import StoredCart
+
+        if not self.cart_id:
+            return None
+        data = cache.get(self._cache_key(self.cart_id))
+        if data is None:
+            data = StoredCart.objects.filter(key=self.cart_id).values_list('data', flat=True).first()
+            if data is None:
+                return None
+            cache.set(self._cache_key(self.cart_id), data, settings.CART_COOKIE_AGE)
+        return data
+
+    def _write(self, payload):
+        cart_id = self.get_or_create_cart_id()
+        data = payload or ''
+        cache.set(self._cache_key(cart_id), data, settings.CART_COOKIE_AGE)
+        write_behind.add(cart_id, data)
+
+    def update_response(self, response):
+        # Re-set on every write so an active cart's cookie does not expire
+        self._set_cookie(response, self.id_cookie_name, self.cart_id)
+
+
+def get_cart_storage(request):
+    """Return the request's cart storage, created on first use"""
+    storage = getattr(request, '_cart_storage', None)
+    if storage is None:
+        storage = request._cart_storage = import_string(settings.CART_STORAGE)(request)
+    return storage
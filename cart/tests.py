@@ -1,7 +1,15 @@
-from django.test import TestCase, Client
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from products.models import Product, ProductVariant, Category
 from .cart import Cart
+from .models import StoredCart
+from .storage import decode_lines, decode_payload, encode_lines, get_cart_storage, write_behind
 
 class CartTests(TestCase):
     def setUp(self):
@@ -20,6 +28,11 @@ class CartTests(TestCase):
             stock_quantity=10
         )
 
+    def cart_lines(self):
+        request = RequestFactory().get('/')
+        request.COOKIES = {name: morsel.value for name, morsel in self.client.cookies.items()}
+        return get_cart_storage(request).load()
+
     def test_add_to_cart(self):
         response = self.client.post(reverse('cart:add'), {
             'product_id': self.product.id,
@@ -29,11 +42,8 @@ class CartTests(TestCase):
         })
         self.assertEqual(response.status_code, 200)
         
-        # Verify session
-        session = self.client.session
-        cart = session.get('cart')
-        self.assertTrue(cart)
-        self.assertEqual(len(cart), 1)
+        # Verify the stored cart
+        self.assertEqual(self.cart_lines(), {(self.product.id, self.variant.id): 1})
 
     def test_cart_persistence(self):
         # Add item
@@ -68,6 +78,122 @@ class CartTests(TestCase):
         })
         self.assertEqual(response.status_code, 200)
         
+        self.assertEqual(self.cart_lines(), {})
+
+    def drawer_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('cart:drawer'))
+        return len(queries)
+
+    def test_drawer_queries_do_not_grow_with_cart_lines(self):
+        self.client.post(reverse('cart:add'), {'product_id': self.product.id, 'quantity': 1})
+        one_line = self.drawer_queries()
+        for i in range(5):
+            product = Product.objects.create(
+                name=f'Other {i}', slug=f'other-{i}', category=self.category, base_price=10,
+            )
+            ProductVariant.objects.create(
+                product=product, size='L', color='Red', stock_quantity=3,
+            )
+            self.client.post(reverse('cart:add'), {
+                'product_id': product.id, 'quantity': 1, 'size': 'L', 'color': 'Red',
+            })
+        self.assertEqual(self.drawer_queries(), one_line + 1)
+
+    def test_lines_are_encoded_compactly(self):
+        lines = {(12, 34): 2, (15, None): 1}
+        self.assertEqual(encode_lines(lines), '12.34.2,15..1')
+        self.assertEqual(decode_lines(encode_lines(lines)), lines)
+        self.assertEqual(decode_lines('12.34.2,junk,7.x.1'), {(12, 34): 2})
+
+    def test_cookie_cart_does_not_use_the_session_table(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('cart:add'), {'product_id': self.product.id, 'quantity': 1})
+            self.client.get(reverse('cart:count'))
+        self.assertFalse([q for q in queries if 'django_session' in q['sql']])
+        self.assertContains(self.client.get(reverse('cart:count')), '>1</span>')
+
+    def test_mutations_swap_the_badge_out_of_band(self):
+        response = self.client.post(reverse('cart:add'), {'product_id': self.product.id, 'quantity': 2},
+                                    HTTP_HX_REQUEST='true')
+        self.assertNotIn('HX-Trigger', response)
+        self.assertContains(response, 'id="cart-count-container" hx-swap-oob="innerHTML"')
+        self.assertContains(response, '>2</span>')
+
+    def test_batch_update_sets_several_lines_in_one_request(self):
+        other = Product.objects.create(name='Other', slug='other', category=self.category, base_price=5)
+        self.client.post(reverse('cart:add'), {'product_id': self.product.id, 'size': 'M', 'color': 'Blue'})
+        self.client.post(reverse('cart:add'), {'product_id': other.id})
+
+        response = self.client.post(reverse('cart:update_lines'), {
+            f'line-{self.product.id}-{self.variant.id}': 3,
+            f'line-{other.id}-': 0,
+            # Lines that are not in the cart are ignored
+            f'line-{other.id}-{self.variant.id}': 5,
+        }, HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cart_lines(), {(self.product.id, self.variant.id): 3})
+        self.assertContains(response, '>3</span>')
+
+    def test_unchanged_cart_answers_not_modified(self):
+        self.client.post(reverse('cart:add'), {'product_id': self.product.id, 'quantity': 1})
+        for name in ('cart:count', 'cart:drawer'):
+            etag = self.client.get(reverse(name))['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertFalse(response.templates)
+
+        etag = self.client.get(reverse('cart:count'))['ETag']
+        self.client.post(reverse('cart:add'), {'product_id': self.product.id, 'quantity': 1})
+        response = self.client.get(reverse('cart:count'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '>2</span>')
+
+    def test_session_cart_from_earlier_releases_is_carried_over(self):
         session = self.client.session
-        cart = session.get('cart')
-        self.assertEqual(len(cart), 0)
+        session['cart'] = {
+            f'{self.product.id}_{self.variant.id}': {
+                'quantity': 2, 'price': '100.00', 'product_id': self.product.id, 'variant_id': self.variant.id,
+            },
+        }
+        self.addCleanup(write_behind.clear)
+        for storage in ('SignedCookieCartStorage', 'SessionCartStorage', 'CacheCartStorage'):
+            with self.subTest(storage=storage), \
+                    override_settings(CART_STORAGE=f'cart.storage.{storage}'):
+                session.save()
+                client = Client()
+                client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+                self.assertContains(client.get(reverse('cart:count')), '>2</span>')
+                # Stored in the new format from then on
+                client.post(reverse('cart:add'), {'product_id': self.product.id, 'size': 'M', 'color': 'Blue'})
+                self.assertContains(client.get(reverse('cart:count')), '>3</span>')
+
+
+@override_settings(CART_STORAGE='cart.storage.CacheCartStorage')
+class CacheCartStorageTests(TestCase):
+    def setUp(self):
+        # The buffer outlives the test database; never leave carts for the exit flush
+        self.addCleanup(write_behind.clear)
+        category = Category.objects.create(name='Test Category', slug='test-cat')
+        self.product = Product.objects.create(
+            name='Test Product', slug='test-product', category=category, base_price=100,
+        )
+
+    def test_cart_survives_cache_eviction_once_written_behind(self):
+        self.client.post(reverse('cart:add'), {'product_id': self.product.id, 'quantity': 3})
+        self.assertFalse(StoredCart.objects.exists())
+        write_behind.flush()
+        _, lines = decode_payload(StoredCart.objects.get().data)
+        self.assertEqual(lines, {(self.product.id, None): 3})
+
+        cache.clear()
+        self.assertContains(self.client.get(reverse('cart:count')), '>3</span>')
+
+    def test_due_carts_are_written_behind_when_a_request_finishes(self):
+        self.client.post(reverse('cart:add'), {'product_id': self.product.id, 'quantity': 1})
+        self.assertFalse(StoredCart.objects.exists())
+        # A quiet period: the next request, whatever it is, writes the batch
+        with mock.patch.object(write_behind, 'flush_interval', 0):
+            self.client.get(reverse('core:home'))
+        self.assertTrue(StoredCart.objects.exists())
@@ -8,6 +8,7 @@ urlpatterns = [
     path('add/', views.cart_add, name='add'),
     path('remove/', views.cart_remove, name='remove'),
     path('update/', views.cart_update, name='update'),
+    path('update-lines/', views.cart_update_lines, name='update_lines'),
     path('count/', views.cart_count, name='count'),
     path('drawer/', views.cart_drawer, name='drawer'),
 ]
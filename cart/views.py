@@ -1,10 +1,22 @@
+from functools import wraps
+
 from django.shortcuts import render, get_object_or_404, redirect
-from django.views.decorators.http import require_POST
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition, require_POST
 from products.models import Product, ProductVariant
+from products.versioning import CATALOG_VERSION, get_version
+from .badge import render_badge
 from .cart import Cart
+from .storage import get_cart_storage, parse_line_key
 from django.template.loader import render_to_string
 from django.http import HttpResponse
 
+
+def _mutation_response(request, cart):
+    """The updated drawer, plus the navbar badge as an out-of-band swap, so a
+    cart change costs the browser one round trip"""
+    return render(request, 'components/cart_drawer_content.html', {'cart': cart, 'oob_count': True})
+
 @require_POST
 def cart_add(request):
     """Add item to cart via HTMX"""
@@ -25,10 +37,7 @@ def cart_add(request):
     
     cart.add(product=product, quantity=quantity, variant=variant)
     
-    # Return updated cart drawer content with trigger for navbar count
-    response = render(request, 'components/cart_drawer_content.html', {'cart': cart})
-    response['HX-Trigger'] = 'cartUpdated'
-    return response
+    return _mutation_response(request, cart)
 
 @require_POST
 def cart_remove(request):
@@ -39,9 +48,7 @@ def cart_remove(request):
     
     cart.remove(product_id=product_id, variant_id=variant_id)
     
-    response = render(request, 'components/cart_drawer_content.html', {'cart': cart})
-    response['HX-Trigger'] = 'cartUpdated'
-    return response
+    return _mutation_response(request, cart)
 
 @require_POST
 def cart_update(request):
@@ -58,20 +65,58 @@ def cart_update(request):
         
     cart.add(product=product, quantity=quantity, variant=variant, update_quantity=True)
     
-    response = render(request, 'components/cart_drawer_content.html', {'cart': cart})
-    response['HX-Trigger'] = 'cartUpdated'
-    return response
+    return _mutation_response(request, cart)
+
+@require_POST
+def cart_update_lines(request):
+    """Set several line quantities at once (``line-<product>-<variant>=<qty>``)"""
+    cart = Cart(request)
+    quantities = {}
+    for name, value in request.POST.items():
+        if not name.startswith('line-'):
+            continue
+        key = parse_line_key(name[len('line-'):].replace('-', '.'))
+        try:
+            quantity = int(value)
+        except ValueError:
+            continue
+        if key is not None:
+            quantities[key] = quantity
+
+    cart.update_lines(quantities)
+    return _mutation_response(request, cart)
 
 def cart_detail(request):
     """Full cart page"""
     cart = Cart(request)
     return render(request, 'pages/cart.html', {'cart': cart})
 
+def _revalidate(view):
+    """Let browsers keep cart partials but check their ETag on every use"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Cookie'])
+        return response
+    return wrapper
+
+def _count_etag(request):
+    return f'count-{get_cart_storage(request).get_revision()}'
+
+def _drawer_etag(request):
+    # The drawer also shows product names, prices and images
+    return f'drawer-{get_cart_storage(request).get_revision()}-{get_version(CATALOG_VERSION)}'
+
+@_revalidate
+@condition(etag_func=_count_etag)
 def cart_count(request):
     """Return just the cart count badge"""
     cart = Cart(request)
-    return render(request, 'components/cart_count.html', {'cart_item_count': len(cart)})
+    return HttpResponse(render_badge(len(cart)))
 
+@_revalidate
+@condition(etag_func=_drawer_etag)
 def cart_drawer(request):
     """Return the cart drawer content partial"""
     cart = Cart(request)
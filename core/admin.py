@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from adminsortable2.admin import SortableAdminMixin
+from .media_resize import resized_url
 from .models import HeroBanner
 
 
@@ -13,6 +14,6 @@ class HeroBannerAdmin(SortableAdminMixin, admin.ModelAdmin):
     
     def image_preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 60px;" />', obj.image.url)
+            return format_html('<img src="{}" style="max-height: 60px;" />', resized_url(obj.image.name, 240, 120))
         return "No image"
     image_preview.short_description = 'Preview'
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+# Backends whose entries live in (or never leave) a single process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+SHARED_CACHE_HINT = (
+    "Point CACHE_BACKEND/CACHE_LOCATION at a cache the workers share, such as "
+    "django.core.cache.backends.redis.RedisCache."
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """Page purges, catalog version bumps and cache-stored carts must reach
+    every worker, which a process-local cache cannot do"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    messages = []
+    if settings.CART_STORAGE.endswith('.CacheCartStorage'):
+        messages.append(Error(
+            f"CacheCartStorage keeps carts in the default cache, but {backend} is not "
+            "shared between processes: carts are lost when a request lands on another worker.",
+            hint=SHARED_CACHE_HINT,
+            id='core.E001',
+        ))
+    if getattr(settings, 'PAGE_CACHE_ENABLED', True):
+        messages.append(Warning(
+            f"The page cache is enabled, but {backend} is not shared between processes: "
+            "with several workers, purges only reach the worker that made them and the "
+            "others keep serving stale pages.",
+            hint=SHARED_CACHE_HINT,
+            id='core.W001',
+        ))
+    return messages
@@ -0,0 +1,176 @@
+"""Fixed-width WebP and JPEG derivatives of uploaded images.
+
+Models using ``ImageDerivativesMixin`` get their ``image`` resized to the
+``DERIVATIVE_WIDTHS`` (never upscaled) whenever a new file is uploaded,
+and record the results in ``image_derivatives``::
+
+    {"webp": [[160, "derivatives/products/tee/160w.webp"], ...],
+     "jpeg": [[160, "derivatives/products/tee/160w.jpg"], ...]}
+
+They also record the image's intrinsic ``image_width``/``image_height``
+(after EXIF rotation) and ``image_placeholder``, a tiny inline WebP data
+URI shown while the real image loads, so pages can reserve the image's
+space and paint something without opening any file at request time.
+
+The resizing happens once the save commits, so it never holds a database
+transaction open; ``image_processed`` is sent when the results are stored.
+
+Templates render them with ``{% responsive_image %}`` (see
+core.templatetags.responsive_images); existing uploads are backfilled with
+the ``generate_image_derivatives`` command.
+"""
+import base64
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.dispatch import Signal
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WIDTHS = (160, 320, 640, 1024, 1600)
+
+PLACEHOLDER_SIZE = 20
+
+# Model fields filled in by process_image()
+IMAGE_FIELDS = ('image_derivatives', 'image_width', 'image_height', 'image_placeholder')
+
+# Sent with ``instance`` once an upload's IMAGE_FIELDS are stored, through
+# queryset.update(), which sends no post_save
+image_processed = Signal()
+
+# format key -> (Pillow format, file extension, save options)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def derivative_dir(name):
+    root, _ = os.path.splitext(name)
+    return f'derivatives/{root}'
+
+
+def derivative_name(name, width, extension):
+    return f'{derivative_dir(name)}/{width}w.{extension}'
+
+
+def smallest_derivative(derivatives, key='jpeg'):
+    """Name of the narrowest ``key`` derivative in ``image_derivatives``, or None"""
+    entries = (derivatives or {}).get(key) or []
+    return min(entries)[1] if entries else None
+
+
+def derivative_widths(width):
+    """Widths to generate for an image ``width`` pixels wide"""
+    widths = [w for w in DERIVATIVE_WIDTHS if w < width]
+    largest = min(width, DERIVATIVE_WIDTHS[-1])
+    if largest not in widths:
+        widths.append(largest)
+    return widths
+
+
+def _flatten(image):
+    """RGB copy of ``image`` with any transparency laid over white, for JPEG"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _open(name, storage):
+    with storage.open(name) as f:
+        image = Image.open(f)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    return image
+
+
+def placeholder_data_uri(image):
+    """A blurry ``PLACEHOLDER_SIZE`` pixel version of ``image`` as a data URI"""
+    small = image.copy()
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.BILINEAR)
+    buffer = BytesIO()
+    small.save(buffer, 'WEBP', quality=40)
+    return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def generate_derivatives(image, name, storage):
+    """Write the derivatives of ``image``, stored as ``name``, and describe them"""
+    derivatives = {key: [] for key in DERIVATIVE_FORMATS}
+    for width in derivative_widths(image.width):
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for key, (pil_format, extension, options) in DERIVATIVE_FORMATS.items():
+            output = resized if pil_format == 'WEBP' else _flatten(resized)
+            buffer = BytesIO()
+            output.save(buffer, pil_format, **options)
+            target = derivative_name(name, width, extension)
+            if storage.exists(target):
+                storage.delete(target)
+            derivatives[key].append([width, storage.save(target, ContentFile(buffer.getvalue()))])
+    return derivatives
+
+
+def process_image(name, derivatives=True, storage=None):
+    """Compute the ``IMAGE_FIELDS`` values of the stored image ``name``.
+
+    With ``derivatives=False`` only the dimensions and placeholder are
+    computed and ``image_derivatives`` is left out. Returns ``{}`` for files
+    Pillow cannot read, so a bad upload keeps being served as-is instead of
+    failing the save.
+    """
+    storage = storage or default_storage
+    try:
+        image = _open(name, storage)
+    except (OSError, UnidentifiedImageError):
+        logger.warning("Cannot process image %s", name, exc_info=True)
+        return {}
+
+    values = {
+        'image_width': image.width,
+        'image_height': image.height,
+        'image_placeholder': placeholder_data_uri(image),
+    }
+    if derivatives:
+        values['image_derivatives'] = generate_derivatives(image, name, storage)
+    return values
+
+
+class ImageDerivativesMixin:
+    """Recompute the ``IMAGE_FIELDS`` whenever a new ``image`` is uploaded.
+
+    The model must define ``image`` and the ``IMAGE_FIELDS``: a JSONField,
+    two nullable integer fields and a text field. They are filled in after
+    the save commits; until then pages show the original upload.
+    """
+
+    def save(self, *args, **kwargs):
+        uploaded = bool(self.image) and not self.image._committed
+        if not self.image:
+            self.image_derivatives = {}
+            self.image_width = self.image_height = None
+            self.image_placeholder = ''
+        super().save(*args, **kwargs)
+        if uploaded:
+            name = self.image.name
+            transaction.on_commit(lambda: self._process_image(name))
+
+    def _process_image(self, name):
+        values = process_image(name)
+        if not values:
+            return
+        # Skipped if a later save replaced the image in the meantime
+        if not type(self).objects.filter(pk=self.pk, image=name).update(**values):
+            return
+        for field, value in values.items():
+            setattr(self, field, value)
+        image_processed.send(sender=type(self), instance=self)
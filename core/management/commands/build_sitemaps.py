@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core import sitemap_files
+
+
+class Command(BaseCommand):
+    help = "Write the sitemap index and sitemaps to SITEMAP_ROOT"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--changed-only', action='store_true',
+            help="Only rewrite sitemaps whose content changed since they were written",
+        )
+
+    def handle(self, *args, changed_only, **options):
+        manifest = sitemap_files.build(force=not changed_only)
+        for section, entry in manifest['sections'].items():
+            self.stdout.write(f"sitemap-{section}.xml: {entry['count']} URLs")
+        self.stdout.write(self.style.SUCCESS(f"Wrote sitemaps to {sitemap_files.sitemap_root()}"))
@@ -0,0 +1,108 @@
+import os
+import posixpath
+from collections import Counter
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.images import derivative_dir
+from core.models import MediaBlob
+from core.storage import (
+    blob_lock, content_addressed_fields, content_addressed_storage, is_content_addressed,
+)
+
+
+class Command(BaseCommand):
+    help = "Delete content-addressed media files that nothing references any more"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours', type=float, default=24,
+            help="Keep files unreferenced for less than this long (uploads in flight)",
+        )
+        parser.add_argument(
+            '--recount', action='store_true',
+            help="Recount references from the database first, repairing counts missed by bulk updates",
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, grace_hours, recount, dry_run, **options):
+        self.dry_run = dry_run
+        cutoff = timezone.now() - timedelta(hours=grace_hours)
+        fields = [(model, field) for model in apps.get_models() for field in content_addressed_fields(model)]
+
+        if recount:
+            self.recount(fields)
+
+        removed = 0
+        unreferenced = MediaBlob.objects.filter(ref_count__lte=0, updated_at__lt=cutoff)
+        for name in unreferenced.values_list('name', flat=True):
+            # Only if it is still unreferenced and unused: an upload may have
+            # just reused it. Uploads check under the same lock, so none can
+            # reuse the file between the row going and the file going.
+            with blob_lock(content_addressed_storage):
+                if dry_run or unreferenced.filter(name=name).delete()[0]:
+                    self.delete_file(name)
+                    removed += 1
+
+        # Files written by uploads whose save was rolled back never got a row
+        known = set(MediaBlob.objects.values_list('name', flat=True))
+        for directory in {field.upload_to for _, field in fields if isinstance(field.upload_to, str)}:
+            for name in self.stored_names(directory.rstrip('/')):
+                if name in known:
+                    continue
+                with blob_lock(content_addressed_storage):
+                    # Reused by an upload meanwhile: it has a row or a new mtime
+                    if MediaBlob.objects.filter(name=name).exists():
+                        continue
+                    if content_addressed_storage.get_modified_time(name) < cutoff:
+                        self.delete_file(name)
+                        removed += 1
+
+        verb = "Would remove" if dry_run else "Removed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {removed} unreferenced files"))
+
+    def recount(self, fields):
+        counts = Counter()
+        for model, field in fields:
+            names = model._base_manager.exclude(**{field.attname: ''}).values_list(field.attname, flat=True)
+            counts.update(name for name in names if is_content_addressed(name))
+        if self.dry_run:
+            return
+        # Newly unreferenced files still get the full grace period
+        MediaBlob.objects.exclude(name__in=counts).exclude(ref_count=0).update(
+            ref_count=0, updated_at=timezone.now(),
+        )
+        blobs = [MediaBlob(name=name, ref_count=count) for name, count in counts.items()]
+        MediaBlob.objects.bulk_create(
+            blobs, update_conflicts=True, unique_fields=['name'], update_fields=['ref_count'],
+        )
+
+    def stored_names(self, directory):
+        storage = content_addressed_storage
+        if not storage.exists(directory):
+            return
+        prefixes, _ = storage.listdir(directory)
+        for prefix in prefixes:
+            for filename in storage.listdir(posixpath.join(directory, prefix))[1]:
+                name = posixpath.join(directory, prefix, filename)
+                if is_content_addressed(name):
+                    yield name
+
+    def delete_file(self, name):
+        self.stdout.write(f"  {name}")
+        if self.dry_run:
+            return
+        storage = content_addressed_storage
+        storage.delete(name)
+        # Derivatives written by core.images live beside each other
+        directory = derivative_dir(name)
+        if storage.exists(directory):
+            for filename in storage.listdir(directory)[1]:
+                storage.delete(posixpath.join(directory, filename))
+            try:
+                os.rmdir(storage.path(directory))
+            except OSError:
+                pass
@@ -0,0 +1,217 @@
+"""On-demand resized copies of uploaded images.
+
+``/media-resize/<w>x<h>/<path>`` serves the media file ``path`` scaled to
+fit within ``w`` x ``h`` as WebP, for the sizes listed in
+``settings.MEDIA_RESIZE_SIZES`` only, so the public endpoint cannot be
+used to force renders of arbitrary sizes. Each derivative is rendered once and kept
+in an on-disk cache addressed by a hash of the source file's content and
+the requested size, so a re-uploaded image never serves a stale
+derivative and identical uploads share theirs.
+
+* Concurrent first requests for the same derivative are single-flighted:
+  one thread (and, where ``fcntl`` is available, one process) renders it
+  while the others wait for the result.
+* The cache is capped at ``settings.MEDIA_RESIZE_CACHE_MAX_BYTES``; the
+  least recently used derivatives are evicted first (file mtimes double as
+  access times and are refreshed on use, at most once an hour).
+
+Content-addressed uploads (see core.storage) never change under their
+name, so their URLs can be cached by browsers and CDNs forever; other
+media files can be replaced in place and are only cached for a while.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-flight within the process only
+    fcntl = None
+
+# Bump to invalidate every derivative after changing how they are rendered
+RENDER_VERSION = 1
+TOUCH_INTERVAL = 60 * 60
+SCAN_INTERVAL = 5 * 60
+
+
+class ResizeError(Exception):
+    """The source is missing, not an image, or the size is not allowed"""
+
+
+def resized_url(name, width, height):
+    """URL of ``name`` resized to fit within ``width`` x ``height``, which
+    must be one of ``settings.MEDIA_RESIZE_SIZES``"""
+    return reverse('core:media_resize', args=[width, height, name])
+
+
+def cache_dir():
+    return getattr(settings, 'MEDIA_RESIZE_CACHE_DIR', None) or os.path.join(settings.MEDIA_ROOT, 'resized')
+
+
+def _source_hash(name):
+    """Content hash of a media file, remembered per modification time and size"""
+    try:
+        modified = default_storage.get_modified_time(name).timestamp()
+        size = default_storage.size(name)
+    except (OSError, ValueError, SuspiciousFileOperation) as e:
+        raise ResizeError(name) from e
+    name_hash = hashlib.md5(name.encode(), usedforsecurity=False).hexdigest()
+    key = f'resize-source:{name_hash}:{modified}:{size}'
+    digest = cache.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        try:
+            # Directories pass the checks above but cannot be opened
+            with default_storage.open(name) as f:
+                for chunk in f.chunks():
+                    sha.update(chunk)
+        except OSError as e:
+            raise ResizeError(name) from e
+        digest = sha.hexdigest()
+        cache.set(key, digest, None)
+    return digest
+
+
+def derivative_key(name, width, height):
+    if [width, height] not in [list(size) for size in settings.MEDIA_RESIZE_SIZES]:
+        raise ResizeError(f'{width}x{height}')
+    source = _source_hash(name)
+    return hashlib.sha256(f'{source}:{width}x{height}:webp:{RENDER_VERSION}'.encode()).hexdigest()
+
+
+def derivative_path(key):
+    return os.path.join(cache_dir(), key[:2], f'{key}.webp')
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+@contextmanager
+def _single_flight(key, path):
+    """Hold the render of ``key``: one thread per process, one process per host"""
+    with _flights_lock:
+        flight = _flights.setdefault(key, [threading.Lock(), 0])
+        flight[1] += 1
+    try:
+        with flight[0]:
+            if fcntl is None:
+                yield
+                return
+            with open(f'{path}.lock', 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    try:
+                        os.remove(f'{path}.lock')
+                    except OSError:
+                        pass
+    finally:
+        with _flights_lock:
+            flight[1] -= 1
+            if not flight[1]:
+                del _flights[key]
+
+
+def _render(name, width, height, path):
+    try:
+        with default_storage.open(name) as f:
+            image = ImageOps.exif_transpose(Image.open(f))
+            image.thumbnail((width, height), Image.LANCZOS)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise ResizeError(name) from e
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.getbands() else 'RGB')
+
+    # Write beside the target and rename, so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            image.save(tmp, 'WEBP', quality=80, method=4)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return os.path.getsize(path)
+
+
+class _SizeCap:
+    """Running size of the cache directory, rescanned now and then since
+    other processes write to it too"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = None
+        self.scanned_at = 0
+
+    def _scan(self, root):
+        files = []
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                if not filename.endswith('.webp'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def added(self, size):
+        limit = settings.MEDIA_RESIZE_CACHE_MAX_BYTES
+        with self._lock:
+            if self.total is not None:
+                self.total += size
+            stale = time.monotonic() - self.scanned_at > SCAN_INTERVAL
+            if self.total is not None and self.total <= limit and not stale:
+                return
+            files = self._scan(cache_dir())
+            self.total = sum(size for _, size, _ in files)
+            self.scanned_at = time.monotonic()
+            if self.total <= limit:
+                return
+            # Evict down to 90% so the next few writes don't rescan
+            files.sort()
+            for _, size, path in files:
+                if self.total <= limit * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self.total -= size
+
+
+size_cap = _SizeCap()
+
+
+def get_resized(name, width, height):
+    """Return ``(key, path)`` of the derivative, rendering it if needed"""
+    key = derivative_key(name, width, height)
+    path = derivative_path(key)
+    try:
+        if time.time() - os.path.getmtime(path) > TOUCH_INTERVAL:
+            os.utime(path)
+        return key, path
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _single_flight(key, path):
+        # Another thread or process may have rendered it while we waited
+        if not os.path.exists(path):
+            size_cap.added(_render(name, width, height, path))
+    return key, path
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.14 on 2026-10-18 16:45
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_image_placeholder"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="herobanner",
+            name="image",
+            field=models.ImageField(
+                storage=core.storage.get_content_addressed_storage, upload_to="banners/"
+            ),
+        ),
+        migrations.CreateModel(
+            name="MediaBlob",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=255, primary_key=True, serialize=False),
+                ),
+                ("ref_count", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["ref_count", "updated_at"],
+                        name="core_mediab_ref_cou_7cfd2c_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -1,11 +1,18 @@
 from django.db import models
 
+from .images import ImageDerivativesMixin
+from .storage import get_content_addressed_storage
 
-class HeroBanner(models.Model):
+
+class HeroBanner(ImageDerivativesMixin, models.Model):
     """Hero banner/slider model for homepage"""
     title = models.CharField(max_length=255)
     subtitle = models.CharField(max_length=255, blank=True)
-    image = models.ImageField(upload_to='banners/')
+    image = models.ImageField(upload_to='banners/', storage=get_content_addressed_storage)
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_placeholder = models.TextField(blank=True, editable=False)
     link_url = models.CharField(max_length=500, blank=True, help_text="Optional link URL")
     button_text = models.CharField(max_length=50, blank=True, default="Shop Now")
     is_active = models.BooleanField(default=True)
@@ -18,3 +25,20 @@ class HeroBanner(models.Model):
 
     def __str__(self):
         return self.title
+
+
+class MediaBlob(models.Model):
+    """A content-addressed media file and how many rows reference it"""
+    name = models.CharField(max_length=255, primary_key=True)
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Garbage collection: unreferenced blobs by age
+            models.Index(fields=['ref_count', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
@@ -0,0 +1,180 @@
+"""Shared full-page cache for anonymous storefront traffic.
+
+Decorated views are rendered once and the HTML is stored without anything
+visitor specific: the CSRF token and the cart badge are rendered as holes
+(see core.context_processors.page_cache) and filled in for each visitor
+when the page is served, so a cache hit never runs the view.
+
+Each stored page records the version of every tag it was rendered under
+(``home``, ``shop``, ``product:<id>``, ``category:<id>``, ...). Purging a
+tag bumps its version counter, which makes every page carrying it stale
+without having to know their keys.
+"""
+import hashlib
+import re
+from functools import lru_cache, wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import add_never_cache_headers
+from django.utils.crypto import salted_hmac
+
+from products.versioning import CATALOG_STRUCTURE_VERSION, bump_version, get_version
+
+PAGE_TIMEOUT = 60 * 60
+# Every page renders the category navigation
+GLOBAL_TAGS = ('structure',)
+
+
+@lru_cache(maxsize=None)
+def _hole_prefix():
+    # Derived from SECRET_KEY: the same in every worker of a deploy, but
+    # unguessable, so text a visitor puts in the URL (and the page echoes
+    # back) can never be taken for a hole
+    return f"__PAGE_HOLE_{salted_hmac('core.page_cache.hole', 'prefix').hexdigest()[:20]}_"
+
+
+@lru_cache(maxsize=None)
+def _hole_re():
+    return re.compile(re.escape(_hole_prefix()) + r'(\w+?)__')
+
+
+def hole(name):
+    """Placeholder rendered in place of per-visitor content"""
+    return f'{_hole_prefix()}{name}__'
+
+
+def _fill_cart_count(request):
+    from cart.context_processors import cart
+
+    return cart(request)['cart_badge']
+
+
+HOLE_FILLERS = {
+    'csrf_token': get_token,
+    'cart_count': _fill_cart_count,
+}
+
+
+def fill_holes(request, content):
+    filled = {}
+
+    def fill(match):
+        name = match.group(1)
+        if name not in HOLE_FILLERS:
+            return match.group(0)
+        if name not in filled:
+            filled[name] = str(HOLE_FILLERS[name](request))
+        return filled[name]
+    return _hole_re().sub(fill, content)
+
+
+def _tag_version_name(tag):
+    if tag == 'structure':
+        return CATALOG_STRUCTURE_VERSION
+    return f'page-tag:{tag}'
+
+
+def _tag_versions(tags):
+    return {tag: get_version(_tag_version_name(tag)) for tag in tags}
+
+
+def purge_tags(*tags):
+    """Invalidate every cached page rendered under any of ``tags``"""
+    for tag in tags:
+        bump_version(_tag_version_name(tag))
+
+
+def add_page_tags(request, *tags):
+    """Tag the page being rendered, for views whose tags depend on the data"""
+    page_tags = getattr(request, 'page_cache_tags', None)
+    if page_tags is not None:
+        page_tags.update(tags)
+
+
+def _page_key(request, query_params):
+    # Only the parameters the view reads, in a fixed order: anything else in
+    # the URL (tracking tags, made-up parameters) shares the same entry
+    query = [(param, request.GET.getlist(param)) for param in query_params if param in request.GET]
+    parts = [request.path, repr(query), request.headers.get('HX-Request', '')]
+    digest = hashlib.md5('|'.join(parts).encode(), usedforsecurity=False).hexdigest()
+    return f'page:{digest}'
+
+
+def _is_cacheable(request):
+    return (
+        getattr(settings, 'PAGE_CACHE_ENABLED', True)
+        and request.method in ('GET', 'HEAD')
+        and 'messages' not in request.COOKIES
+        and not request.user.is_authenticated
+    )
+
+
+def _can_store(request, response):
+    messages = getattr(request, '_messages', None)
+    return (
+        response.status_code == 200
+        and not response.cookies
+        and not (messages is not None and len(messages))
+    )
+
+
+def _finish(request, response, status):
+    response['X-Page-Cache'] = status
+    # The stored copy is shared; browsers and proxies must not keep the
+    # filled-in one, which carries this visitor's token and cart count.
+    add_never_cache_headers(response)
+    return response
+
+
+def cache_anonymous_page(*tags, query_params=()):
+    """Serve a view from the shared page cache for anonymous visitors.
+
+    ``query_params`` names the query parameters the view reads; requests
+    carrying others are served from the same entry, but never stored, since
+    the view may echo them into links.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable(request):
+                return view(request, *args, **kwargs)
+
+            key = _page_key(request, query_params)
+            entry = cache.get(key)
+            if entry is not None and _tag_versions(entry['tags']) == entry['tags']:
+                response = HttpResponse(
+                    fill_holes(request, entry['content']), content_type=entry['content_type']
+                )
+                return _finish(request, response, 'hit')
+
+            request.page_cache_tags = set(tags) | set(GLOBAL_TAGS)
+            # Read before rendering so a purge that races the render leaves
+            # the stored copy stale rather than current
+            versions = _tag_versions(request.page_cache_tags)
+            request.page_cache_render = True
+            try:
+                response = view(request, *args, **kwargs)
+            finally:
+                # Error pages rendered after an exception must not get holes
+                request.page_cache_render = False
+            if response.streaming:
+                return response
+
+            content = response.content.decode(response.charset)
+            response.content = fill_holes(request, content)
+            if not _can_store(request, response) or not set(request.GET) <= set(query_params):
+                return response
+
+            # Tags added by the view itself are only known now
+            versions.update(_tag_versions(request.page_cache_tags - versions.keys()))
+            cache.set(key, {
+                'content': content,
+                'content_type': response['Content-Type'],
+                'tags': versions,
+            }, PAGE_TIMEOUT)
+            return _finish(request, response, 'miss')
+        return wrapper
+    return decorator
@@ -0,0 +1,66 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .images import image_processed
+from .models import HeroBanner
+from .page_cache import purge_tags
+from .storage import add_reference, content_addressed_fields, remove_reference
+
+
+@receiver(post_save, sender=HeroBanner)
+@receiver(post_delete, sender=HeroBanner)
+@receiver(image_processed, sender=HeroBanner)
+def banner_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: purge_tags('home'))
+
+
+def _field_names(instance, fields):
+    names = {}
+    for field in fields:
+        # Deferred fields are unknown until loaded; leave them untracked
+        if field.attname in instance.__dict__:
+            value = instance.__dict__[field.attname]
+            names[field.attname] = getattr(value, 'name', value) or None
+    return names
+
+
+def track_media_references(model):
+    """Keep MediaBlob reference counts in step with ``model``'s file fields.
+
+    Saves and deletes are counted; queryset.update() and bulk operations
+    are not (``collect_media_garbage --recount`` repairs the counts).
+    """
+    fields = content_addressed_fields(model)
+    if not fields:
+        return
+
+    def remember(sender, instance, **kwargs):
+        instance._media_names = _field_names(instance, fields)
+
+    def saved(sender, instance, created, raw=False, **kwargs):
+        if raw:
+            return
+        previous = getattr(instance, '_media_names', {})
+        current = _field_names(instance, fields)
+        for attname, name in current.items():
+            if attname not in previous and not created:
+                continue
+            old = previous.get(attname)
+            if name != old:
+                add_reference(name)
+                remove_reference(old)
+        instance._media_names = current
+
+    def deleted(sender, instance, **kwargs):
+        for name in getattr(instance, '_media_names', {}).values():
+            remove_reference(name)
+
+    post_init.connect(remember, sender=model, weak=False)
+    post_save.connect(saved, sender=model, weak=False)
+    post_delete.connect(deleted, sender=model, weak=False)
+
+
+for _model in apps.get_models():
+    track_media_references(_model)
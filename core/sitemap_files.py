@@ -0,0 +1,186 @@
+"""Sitemaps written to disk and served as static files.
+
+``/sitemap.xml`` is a sitemap index pointing at one sitemap per section:
+``static``, ``categories`` and ``products-<n>`` (see products.sitemaps).
+Each is written once to ``settings.SITEMAP_ROOT`` by streaming rows from
+the database, so memory use does not depend on the catalog size.
+
+Catalog writes bump the version counter of the sections they touch (and
+of the index); a request for a stale file rewrites just that file first.
+Every other request is a file read with no database access, answered with
+304 when the crawler's ETag or Last-Modified still match. The
+``build_sitemaps`` command rewrites everything.
+"""
+import json
+import os
+import tempfile
+import threading
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.urls import reverse
+
+from products import sitemaps as catalog
+from products.versioning import get_version
+
+from .sitemaps import StaticViewSitemap
+
+NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+# section prefix -> (changefreq, priority)
+SECTION_DEFAULTS = {
+    'static': ('monthly', '0.5'),
+    'categories': ('weekly', '0.8'),
+    'products': ('weekly', '0.9'),
+}
+
+_lock = threading.Lock()
+
+
+def sitemap_root():
+    return str(settings.SITEMAP_ROOT)
+
+
+def _base_url():
+    protocol = getattr(settings, 'SITEMAP_PROTOCOL', 'https')
+    return f'{protocol}://{Site.objects.get_current().domain}'
+
+
+def _static_entries():
+    sitemap = StaticViewSitemap()
+    for item in sitemap.items():
+        yield sitemap.location(item), None
+
+
+def _entries(section):
+    if section == 'static':
+        return _static_entries()
+    if section == 'categories':
+        return catalog.category_entries()
+    prefix, _, chunk = section.partition('-')
+    if prefix == 'products' and chunk.isdigit():
+        return catalog.product_entries(int(chunk))
+    raise KeyError(section)
+
+
+def section_path(section):
+    return os.path.join(sitemap_root(), f'sitemap-{section}.xml')
+
+
+def index_path():
+    return os.path.join(sitemap_root(), 'sitemap.xml')
+
+
+class _AtomicFile:
+    """Write to a temporary file and move it into place on success"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+        self.file = os.fdopen(fd, 'w', encoding='utf-8')
+        return self.file
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.unlink(self.tmp_path)
+
+
+def write_section(section, base_url):
+    """Write one sitemap; returns ``(url count, newest lastmod)``"""
+    changefreq, priority = SECTION_DEFAULTS[section.partition('-')[0]]
+    count = 0
+    newest = None
+    with _AtomicFile(section_path(section)) as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{NAMESPACE}">\n')
+        for path, lastmod in _entries(section):
+            f.write(f'<url><loc>{escape(base_url + path)}</loc>')
+            if lastmod is not None:
+                f.write(f'<lastmod>{lastmod.date().isoformat()}</lastmod>')
+                newest = lastmod if newest is None else max(newest, lastmod)
+            f.write(f'<changefreq>{changefreq}</changefreq><priority>{priority}</priority></url>\n')
+            count += 1
+        f.write('</urlset>\n')
+    return count, newest
+
+
+def _load_manifest():
+    try:
+        with open(os.path.join(sitemap_root(), 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'index_version': None, 'sections': {}}
+
+
+def _save_manifest(manifest):
+    with _AtomicFile(os.path.join(sitemap_root(), 'manifest.json')) as f:
+        json.dump(manifest, f)
+
+
+def _write_index(sections, base_url):
+    with _AtomicFile(index_path()) as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{NAMESPACE}">\n')
+        for section, entry in sections.items():
+            loc = base_url + reverse('sitemap_section', args=[section])
+            f.write(f'<sitemap><loc>{escape(loc)}</loc>')
+            if entry['lastmod']:
+                f.write(f"<lastmod>{entry['lastmod']}</lastmod>")
+            f.write('</sitemap>\n')
+        f.write('</sitemapindex>\n')
+
+
+def build(force=False):
+    """Bring the index and every section up to date; returns the manifest.
+
+    Only sections whose version changed since they were written are
+    rewritten, unless ``force``.
+    """
+    with _lock:
+        index_version = get_version(catalog.SITEMAP_INDEX_VERSION)
+        manifest = _load_manifest()
+        if not force and manifest['index_version'] == index_version and os.path.exists(index_path()):
+            return manifest
+
+        base_url = _base_url()
+        sections = {}
+        for section in ['static', 'categories', *catalog.product_sections()]:
+            version = get_version(catalog.sitemap_version(section))
+            entry = manifest['sections'].get(section)
+            if force or entry is None or entry['version'] != version or not os.path.exists(section_path(section)):
+                count, newest = write_section(section, base_url)
+                entry = {'version': version, 'count': count, 'lastmod': newest and newest.isoformat()}
+            sections[section] = entry
+
+        # Sections that lost all their products
+        for section in manifest['sections'].keys() - sections.keys():
+            try:
+                os.remove(section_path(section))
+            except OSError:
+                pass
+
+        _write_index(sections, base_url)
+        manifest = {'index_version': index_version, 'sections': sections}
+        _save_manifest(manifest)
+        return manifest
+
+
+def get_file(section=None):
+    """Path of an up-to-date sitemap file, or None if there is no such section"""
+    manifest = build()
+    if section is None:
+        return index_path()
+    entry = manifest['sections'].get(section)
+    if entry is None:
+        return None
+    if entry['version'] != get_version(catalog.sitemap_version(section)):
+        # Changed since the index was built: the index is stale too
+        manifest = build()
+        if section not in manifest['sections']:
+            return None
+    return section_path(section)
@@ -0,0 +1,146 @@
+"""Content-addressed storage for uploaded images.
+
+Files are named after the SHA-256 of their content, under the field's
+``upload_to`` directory (``products/3f/3fa9...e1.jpg``). Uploading a file
+whose content is already stored writes nothing and reuses the existing
+name, so the same photo attached to several products is kept once, and a
+name always refers to the same bytes, so media URLs can be cached forever.
+
+Every content-addressed name has a ``MediaBlob`` row counting the model
+instances that reference it (maintained by core.signals on save and
+delete). Files nobody references any more are removed by the
+``collect_media_garbage`` command. An upload that reuses a stored file
+first marks it as recently used, and both that and the collector's
+check-and-delete run under ``blob_lock``, so a file is never deleted from
+under an upload that has just reused it.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import threading
+from contextlib import contextmanager
+
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F, FileField
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+try:
+    import fcntl
+except ImportError:  # Windows: serialised within the process only
+    fcntl = None
+
+CONTENT_NAME_RE = re.compile(r'(?:^|/)([0-9a-f]{2})/\1[0-9a-f]{62}\.\w+$')
+
+
+def is_content_addressed(name):
+    return bool(name and CONTENT_NAME_RE.search(name))
+
+
+class _AlreadyStored(Exception):
+    pass
+
+
+_blob_lock = threading.Lock()
+
+
+@contextmanager
+def blob_lock(storage):
+    """Serialise reusing stored files against garbage collection deleting
+    them: one thread per process, one process per host"""
+    with _blob_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(storage.location, exist_ok=True)
+        with open(os.path.join(storage.location, '.media-gc.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def mark_used(storage, name):
+    """Restart the collector's grace period for a stored file"""
+    from .models import MediaBlob
+
+    if not MediaBlob.objects.filter(name=name).update(updated_at=timezone.now()):
+        # A file without a row yet is collected by its age
+        os.utime(storage.path(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def content_name(self, name, content):
+        """Content-derived name for ``content`` uploaded as ``name``"""
+        sha = hashlib.sha256()
+        for chunk in content.chunks():
+            sha.update(chunk)
+        content.seek(0)
+        digest = sha.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(posixpath.dirname(name), digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        with blob_lock(self):
+            if self.exists(name):
+                mark_used(self, name)
+                return name
+        try:
+            return super().save(name, content, max_length=max_length)
+        except _AlreadyStored:
+            return name
+
+    def get_available_name(self, name, max_length=None):
+        # Identical content is already there (possibly written by a
+        # concurrent upload a moment ago): keep it rather than renaming
+        if self.exists(name):
+            raise _AlreadyStored(name)
+        return super().get_available_name(name, max_length=max_length)
+
+
+content_addressed_storage = ContentAddressedStorage()
+
+
+def get_content_addressed_storage():
+    return content_addressed_storage
+
+
+def content_addressed_fields(model):
+    """The model's file fields stored by name of content"""
+    return [
+        field for field in model._meta.concrete_fields
+        if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage)
+    ]
+
+
+def add_reference(name):
+    from .models import MediaBlob
+
+    if not is_content_addressed(name):
+        return
+    now = timezone.now()
+    if MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1, updated_at=now):
+        return
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(name=name, ref_count=1)
+    except IntegrityError:
+        # Created concurrently
+        MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1, updated_at=now)
+
+
+def remove_reference(name):
+    from .models import MediaBlob
+
+    if is_content_addressed(name):
+        MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') - 1, updated_at=timezone.now())
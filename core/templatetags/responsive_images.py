@@ -0,0 +1,50 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+register = template.Library()
+
+
+def _srcset(entries):
+    return ', '.join(f'{default_storage.url(name)} {width}w' for width, name in entries)
+
+
+@register.simple_tag
+def responsive_image(url, derivatives=None, sizes='100vw', placeholder='', **attrs):
+    """
+    Render an image with a WebP/JPEG ``srcset`` built from its derivatives
+    (see core.images), falling back to a plain ``<img>`` of ``url``.
+
+    Usage::
+
+        {% responsive_image card.image_url card.image_derivatives sizes="25vw" alt=card.image_alt class="h-full w-full" width=card.image_width height=card.image_height placeholder=card.image_placeholder %}
+
+    ``placeholder`` (a data URI) is painted as the image's background until
+    it loads. Any other keyword becomes an attribute of the ``<img>``, so
+    pass the intrinsic ``width`` and ``height`` to reserve its space; empty
+    ones are left out. Images load lazily unless ``loading`` says otherwise.
+    """
+    if not url:
+        return ''
+    if placeholder:
+        attrs['style'] = f"background: url({placeholder}) center / cover no-repeat"
+    attrs.setdefault('alt', '')
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    if not derivatives or not derivatives.get('jpeg'):
+        return format_html('<img src="{}"{}>', url, flatatt(attrs))
+
+    jpeg = derivatives['jpeg']
+    img = format_html(
+        '<img src="{}" srcset="{}" sizes="{}"{}>',
+        default_storage.url(jpeg[-1][1]), _srcset(jpeg), sizes, flatatt(attrs),
+    )
+    if not derivatives.get('webp'):
+        return img
+    # display: contents keeps the wrapper out of the layout, so the <img>
+    # sizes against its container exactly as it did without one
+    return format_html(
+        '<picture style="display: contents"><source type="image/webp" srcset="{}" sizes="{}">{}</picture>',
+        _srcset(derivatives['webp']), sizes, img,
+    )
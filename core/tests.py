@@ -1,3 +1,507 @@
-from django.test import TestCase
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import URLPattern, get_resolver, reverse
+from orders.models import Order
+from PIL import Image
+from products.models import Category, Product, ProductCard, ProductImage, ProductVariant
+from products import sitemaps as product_sitemaps
+from products.versioning import get_version
+from . import media_resize, sitemap_files
+from .checks import check_shared_cache
+from .storage import content_addressed_storage, is_content_addressed
+from .models import HeroBanner, MediaBlob
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.tops = Category.objects.create(name='Tops', slug='tops')
+        self.shoes = Category.objects.create(name='Shoes', slug='shoes')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tee = Product.objects.create(
+                name='Tee', slug='tee', category=self.tops, description='Test', base_price=10,
+            )
+            self.boot = Product.objects.create(
+                name='Boot', slug='boot', category=self.shoes, description='Test', base_price=80,
+            )
+            self.variant = ProductVariant.objects.create(
+                product=self.tee, size='M', color='Blue', stock_quantity=5,
+            )
+        self.tee_url = reverse('products:detail', args=['tee'])
+
+    def test_second_visit_is_served_without_the_view(self):
+        self.assertEqual(self.client.get(self.tee_url)['X-Page-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            response = self.client.get(self.tee_url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertTemplateNotUsed(response, 'pages/product_detail.html')
+        self.assertContains(response, 'Tee')
+        self.assertNotContains(response, '__PAGE_HOLE_')
+
+    def test_holes_are_filled_per_visitor(self):
+        self.client.get(self.tee_url)
+
+        shopper = Client(enforce_csrf_checks=True)
+        shopper.get(self.tee_url)
+        token = re.search(r'name="csrfmiddlewaretoken" value="(\w+)"',
+                          shopper.get(self.tee_url).content.decode()).group(1)
+        response = shopper.post(reverse('cart:add'), {
+            'product_id': self.tee.id, 'quantity': 2, 'size': 'M', 'color': 'Blue',
+            'csrfmiddlewaretoken': token,
+        })
+        self.assertEqual(response.status_code, 200)
+
+        response = shopper.get(self.tee_url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, '>2</span>')
+        self.assertNotContains(self.client.get(self.tee_url), '>2</span>')
+
+    def test_visitor_query_strings_cannot_fill_holes_or_grow_the_cache(self):
+        shop = reverse('products:shop')
+        for value in ('__PAGE_HOLE_zzz__', '__PAGE_HOLE_csrf_token__'):
+            response = self.client.get(shop, {'size': value})
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, value)
+        self.assertEqual(self.client.get(shop, {'x': '__PAGE_HOLE_zzz__'}).status_code, 200)
+
+        self.assertEqual(self.client.get(shop, {'sort': 'newest', 'size': 'M'})['X-Page-Cache'], 'miss')
+        # Same parameters in another order, plus ones the shop ignores
+        response = self.client.get(f'{shop}?utm_source=mail&size=M&sort=newest')
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertNotContains(response, 'utm_source')
+
+    def test_process_local_caches_are_reported(self):
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+        with override_settings(CACHES=locmem, PAGE_CACHE_ENABLED=True,
+                               CART_STORAGE='cart.storage.CacheCartStorage'):
+            self.assertEqual([m.id for m in check_shared_cache(None)], ['core.E001', 'core.W001'])
+        with override_settings(CACHES=redis, PAGE_CACHE_ENABLED=True,
+                               CART_STORAGE='cart.storage.CacheCartStorage'):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_writes_purge_only_the_pages_showing_them(self):
+        shop, tops, shoes = reverse('products:shop'), reverse('products:category', args=['tops']), \
+            reverse('products:category', args=['shoes'])
+        for url in (shop, tops, shoes, self.tee_url):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tee.name = 'Long Sleeve Tee'
+            self.tee.save()
+
+        for url in (shop, tops, self.tee_url):
+            response = self.client.get(url)
+            self.assertEqual(response['X-Page-Cache'], 'miss')
+            self.assertContains(response, 'Long Sleeve Tee')
+        self.assertEqual(self.client.get(shoes)['X-Page-Cache'], 'hit')
+
+
+class ZeroWriteBrowsingTests(TestCase):
+    """Anonymous GETs (crawlers, first visits) must not write to the database"""
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(name='Tops', slug='tops')
+            self.product = Product.objects.create(
+                name='Tee', slug='tee', category=self.category, description='Test', base_price=10,
+            )
+            ProductVariant.objects.create(product=self.product, size='M', color='Blue', stock_quantity=5)
+        self.order = Order.objects.create(
+            customer_name='Test', phone='123', address='Street', city='City', total_amount=10,
+        )
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root, SITEMAP_ROOT=media_root + '/sitemaps'))
+        # Values for the URL parameters, by name
+        self.url_kwargs = {
+            'slug': self.product.slug,
+            'category_slug': self.category.slug,
+            'order_number': self.order.order_number,
+            'width': 200,
+            'height': 200,
+            'name': default_storage.save('products/photo.png', make_image(200, 200)),
+            'section': 'categories',
+        }
+
+    def site_urls(self, patterns=None, prefix=''):
+        """Every URL of the storefront, with sample values for parameters"""
+        urls = []
+        for pattern in patterns if patterns is not None else get_resolver().url_patterns:
+            if isinstance(pattern, URLPattern):
+                if pattern.name is None:
+                    urls.append('/' + str(pattern.pattern))
+                else:
+                    name = f'{prefix}:{pattern.name}' if prefix else pattern.name
+                    kwargs = {key: self.url_kwargs[key] for key in pattern.pattern.converters}
+                    urls.append(reverse(name, kwargs=kwargs))
+            elif pattern.namespace == 'admin':
+                # Staff only: anonymous requests just redirect to the login page
+                urls += [reverse('admin:index'), reverse('admin:login')]
+            else:
+                urls += self.site_urls(pattern.url_patterns, pattern.namespace or prefix)
+        return urls
+
+    def test_get_every_url_without_writes(self):
+        urls = self.site_urls()
+        self.assertIn(reverse('cart:count'), urls)
+        for storage in ('SignedCookieCartStorage', 'CacheCartStorage', 'SessionCartStorage'):
+            with self.subTest(storage=storage), \
+                    override_settings(CART_STORAGE=f'cart.storage.{storage}'):
+                for url in urls:
+                    self.assert_no_writes(url)
+
+    def assert_no_writes(self, url):
+        client = Client()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        # 405 for the POST-only cart endpoints
+        self.assertIn(response.status_code, (200, 302, 405), url)
+        writes = [q['sql'] for q in queries
+                  if q['sql'].lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(writes, [], url)
+        self.assertNotIn('sessionid', response.cookies, url)
+
+
+def make_image(width, height, format='PNG'):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), (200, 40, 40)).save(buffer, format)
+    return SimpleUploadedFile(f'photo.{format.lower()}', buffer.getvalue())
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+    def test_upload_generates_derivatives(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            banner = HeroBanner.objects.create(title='Drop', image=make_image(2000, 1000))
+            # Rendered once the save commits
+            self.assertEqual(banner.image_derivatives, {})
+        banner.refresh_from_db()
+        webp = banner.image_derivatives['webp']
+        self.assertEqual([width for width, _ in webp], [160, 320, 640, 1024, 1600])
+        with default_storage.open(webp[0][1]) as f:
+            self.assertEqual(Image.open(f).size, (160, 80))
+        self.assertEqual((banner.image_width, banner.image_height), (2000, 1000))
+        self.assertTrue(banner.image_placeholder.startswith('data:image/webp;base64,'))
+        self.assertLess(len(banner.image_placeholder), 500)
+
+        html = Template(
+            '{% load responsive_images %}{% responsive_image banner.image.url banner.image_derivatives sizes="50vw" alt="Drop"'
+            ' width=banner.image_width height=banner.image_height placeholder=banner.image_placeholder %}'
+        ).render(Context({'banner': banner}))
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('160w.jpg 160w', html)
+        self.assertIn('sizes="50vw"', html)
+        self.assertIn('width="2000"', html)
+        self.assertIn('height="1000"', html)
+        self.assertIn('style="background: url(data:image/webp;base64,', html)
+
+    def test_small_images_are_not_upscaled(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            banner = HeroBanner.objects.create(title='Drop', image=make_image(200, 200))
+        self.assertEqual([width for width, _ in banner.image_derivatives['jpeg']], [160, 200])
+
+    def test_product_cards_pick_up_derivatives_after_commit(self):
+        category = Category.objects.create(name='Tops', slug='tops')
+        product = Product.objects.create(
+            name='Tee', slug='tee', category=category, description='Test', base_price=10,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=product, image=make_image(400, 400, 'JPEG'))
+        card = ProductCard.objects.get()
+        self.assertEqual(card.image_width, 400)
+        self.assertEqual(card.image_derivatives, image.image_derivatives)
+
+    def test_replaced_images_keep_the_newer_results(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            banner = HeroBanner.objects.create(title='Drop', image=make_image(400, 200))
+            banner.image = make_image(200, 200)
+            banner.save()
+        # The first upload finishing last must not overwrite the second's results
+        for callback in reversed(callbacks):
+            callback()
+        banner.refresh_from_db()
+        self.assertEqual((banner.image_width, banner.image_height), (200, 200))
+
+    def test_command_backfills_existing_images(self):
+        category = Category.objects.create(name='Tops', slug='tops')
+        product = Product.objects.create(
+            name='Tee', slug='tee', category=category, description='Test', base_price=10,
+        )
+        image = ProductImage.objects.create(product=product, image=make_image(400, 400, 'JPEG'))
+        ProductImage.objects.update(image_derivatives={}, image_width=None, image_placeholder='')
+
+        call_command('generate_image_derivatives', workers=2, stdout=StringIO())
+        image.refresh_from_db()
+        self.assertEqual([width for width, _ in image.image_derivatives['webp']], [160, 320, 400])
+        self.assertEqual(image.image_width, 400)
+        card = ProductCard.objects.get()
+        self.assertEqual(card.image_derivatives, image.image_derivatives)
+        self.assertEqual(card.image_placeholder, image.image_placeholder)
+
+        # Placeholders alone can be backfilled without touching derivatives
+        ProductImage.objects.update(image_derivatives={}, image_placeholder='')
+        call_command('generate_image_derivatives', workers=1, placeholders_only=True, stdout=StringIO())
+        image.refresh_from_db()
+        self.assertEqual(image.image_derivatives, {})
+        self.assertTrue(image.image_placeholder)
+
+
+class MediaResizeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(
+            MEDIA_ROOT=media_root, MEDIA_RESIZE_SIZES=[(64, 64), (100, 100), (200, 200), (300, 300)],
+        ))
+        cache.clear()
+        media_resize.size_cap.total = None
+        self.name = content_addressed_storage.save('products/photo.png', make_image(800, 400))
+        self.url = media_resize.resized_url(self.name, 100, 100)
+
+    def test_serves_cached_derivative_with_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        legacy = default_storage.save('legacy/photo.png', make_image(100, 100))
+        self.assertNotIn('immutable', self.client.get(media_resize.resized_url(legacy, 100, 100))['Cache-Control'])
+        self.assertEqual(Image.open(BytesIO(b''.join(response.streaming_content))).size, (100, 50))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(media_resize.resized_url('products/missing.png', 100, 100)).status_code, 404)
+        self.assertEqual(self.client.get(media_resize.resized_url('products', 100, 100)).status_code, 404)
+        # Only the configured sizes are rendered
+        self.assertEqual(self.client.get(media_resize.resized_url(self.name, 101, 100)).status_code, 404)
+
+    def test_derivatives_evicted_before_they_are_opened_are_rendered_again(self):
+        get_resized = media_resize.get_resized
+        calls = []
+
+        def evicting_get_resized(*args):
+            key, path = get_resized(*args)
+            if not calls:
+                os.remove(path)
+            calls.append(args)
+            return key, path
+
+        with mock.patch('core.views.get_resized', evicting_get_resized):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(BytesIO(b''.join(response.streaming_content))).size, (100, 50))
+        self.assertEqual(len(calls), 2)
+
+    def test_concurrent_first_requests_render_once(self):
+        render = media_resize._render
+        renders = []
+        start = threading.Barrier(8)
+
+        def counting_render(*args):
+            renders.append(args)
+            time.sleep(0.05)
+            return render(*args)
+
+        def fetch():
+            start.wait()
+            media_resize.get_resized(self.name, 64, 64)
+
+        with mock.patch.object(media_resize, '_render', counting_render):
+            threads = [threading.Thread(target=fetch) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(renders), 1)
+
+    def test_least_recently_used_derivatives_are_evicted(self):
+        _, first = media_resize.get_resized(self.name, 300, 300)
+        os.utime(first, (1, 1))
+        _, second = media_resize.get_resized(self.name, 200, 200)
+        with override_settings(MEDIA_RESIZE_CACHE_MAX_BYTES=os.path.getsize(second) + 10):
+            _, third = media_resize.get_resized(self.name, 100, 100)
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(third))
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        category = Category.objects.create(name='Tops', slug='tops')
+        self.product = Product.objects.create(
+            name='Tee', slug='tee', category=category, description='Test', base_price=10,
+        )
+
+    def add_image(self, upload_name='photo.png'):
+        upload = make_image(300, 300)
+        upload.name = upload_name
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductImage.objects.create(product=self.product, image=upload)
+
+    def gc(self, **options):
+        call_command('collect_media_garbage', grace_hours=0, stdout=StringIO(), **options)
+
+    def test_identical_uploads_are_stored_once_and_collected_when_unused(self):
+        first = self.add_image('front.png')
+        second = self.add_image('copy of front.png')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^products/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(len(os.listdir(os.path.dirname(first.image.path))), 1)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 2)
+
+        first.delete()
+        self.gc()
+        self.assertTrue(default_storage.exists(second.image.name))
+
+        second.delete()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 0)
+        self.gc()
+        self.assertFalse(default_storage.exists(second.image.name))
+        self.assertFalse(default_storage.exists(second.image_derivatives['webp'][0][1]))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_recount_repairs_counts_missed_by_bulk_updates(self):
+        image = self.add_image()
+        name = image.image.name
+        # queryset.update() bypasses the reference counting
+        ProductImage.objects.update(image='')
+        self.gc(recount=True)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 0)
+        self.gc()
+        self.assertFalse(default_storage.exists(name))
+
+    def test_files_without_a_row_are_collected(self):
+        # e.g. written by an upload whose transaction rolled back
+        name = content_addressed_storage.save('products/photo.png', make_image(10, 10))
+        self.assertTrue(is_content_addressed(name))
+        self.gc()
+        self.assertFalse(default_storage.exists(name))
+
+    def test_reusing_a_stored_file_restarts_its_grace_period(self):
+        image = self.add_image()
+        name = image.image.name
+        image.delete()
+        day_ago = timezone.now() - timedelta(days=1)
+        MediaBlob.objects.update(updated_at=day_ago)
+        os.utime(default_storage.path(name), (day_ago.timestamp(), day_ago.timestamp()))
+
+        # An upload of the same content, not yet saved to a row
+        self.assertEqual(content_addressed_storage.save('products/again.png', make_image(300, 300)), name)
+        call_command('collect_media_garbage', grace_hours=1, stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+        # Likewise for a file whose row is already gone
+        MediaBlob.objects.all().delete()
+        os.utime(default_storage.path(name), (day_ago.timestamp(), day_ago.timestamp()))
+        content_addressed_storage.save('products/again.png', make_image(300, 300))
+        call_command('collect_media_garbage', grace_hours=1, stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+
+class SitemapTests(TestCase):
+    def setUp(self):
+        sitemap_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, sitemap_root)
+        self.enterContext(override_settings(SITEMAP_ROOT=sitemap_root))
+        self.enterContext(mock.patch.object(product_sitemaps, 'PRODUCTS_PER_SITEMAP', 2))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(name='Tops', slug='tops')
+            self.products = [
+                Product.objects.create(
+                    name=f'Tee {i}', slug=f'tee-{i}', category=self.category, description='Test', base_price=10,
+                )
+                for i in range(3)
+            ]
+
+    def sections(self):
+        return [product_sitemaps.product_chunk(p.pk) for p in self.products]
+
+    def test_index_lists_sections_and_sections_list_urls(self):
+        response = self.client.get('/sitemap.xml')
+        self.assertEqual(response['Content-Type'], 'application/xml')
+        index = b''.join(response.streaming_content).decode()
+        for chunk in set(self.sections()):
+            self.assertIn(f'/sitemap-products-{chunk}.xml</loc>', index)
+        self.assertIn('/sitemap-categories.xml</loc>', index)
+
+        chunk = self.sections()[0]
+        response = self.client.get(f'/sitemap-products-{chunk}.xml')
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn(f'<loc>https://example.com/shop/product/{self.products[0].slug}/</loc>', content)
+        self.assertIn(f'<lastmod>{self.products[0].updated_at.date().isoformat()}</lastmod>', content)
+
+        self.assertEqual(self.client.get('/sitemap-products-999.xml').status_code, 404)
+        self.assertEqual(self.client.get('/sitemap-nope.xml').status_code, 404)
+
+    def test_unchanged_sitemaps_are_not_modified_and_read_nothing(self):
+        etag = self.client.get('/sitemap-categories.xml')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/sitemap-categories.xml', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_product_change_rewrites_only_its_sitemap(self):
+        self.client.get('/sitemap.xml')
+        changed, other = self.products[0], self.products[-1]
+        self.assertNotEqual(self.sections()[0], self.sections()[-1])
+        mtimes = {
+            p.pk: os.stat(sitemap_files.section_path(f'products-{product_sitemaps.product_chunk(p.pk)}')).st_mtime_ns
+            for p in (changed, other)
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            changed.slug = 'renamed-tee'
+            changed.save()
+
+        with mock.patch.object(sitemap_files, 'write_section', wraps=sitemap_files.write_section) as write:
+            response = self.client.get(f'/sitemap-products-{product_sitemaps.product_chunk(changed.pk)}.xml')
+        self.assertEqual([c.args[0] for c in write.call_args_list], [f'products-{self.sections()[0]}'])
+        self.assertIn('/renamed-tee/', b''.join(response.streaming_content).decode())
+        self.assertEqual(
+            os.stat(sitemap_files.section_path(f'products-{self.sections()[-1]}')).st_mtime_ns, mtimes[other.pk],
+        )
+
+    def test_category_saves_leave_product_sitemaps_alone(self):
+        version = lambda: get_version(product_sitemaps.sitemap_version(f'products-{self.sections()[0]}'))
+        before, updated_at = version(), self.products[0].card.updated_at
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.order = 5
+            self.category.save()
+        self.assertEqual(version(), before)
+        self.assertEqual(ProductCard.objects.get(pk=self.products[0].pk).updated_at, updated_at)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Shirts'
+            self.category.save()
+        self.assertEqual(version(), before)
+        # The cards still pick up the new name
+        self.assertGreater(ProductCard.objects.get(pk=self.products[0].pk).updated_at, updated_at)
+
+    def test_build_command_writes_every_sitemap(self):
+        out = StringIO()
+        call_command('build_sitemaps', stdout=out)
+        self.assertTrue(os.path.exists(sitemap_files.index_path()))
+        for section in ['static', 'categories', *product_sitemaps.product_sections()]:
+            self.assertTrue(os.path.exists(sitemap_files.section_path(section)), section)
+        self.assertIn('sitemap-static.xml: 6 URLs', out.getvalue())
@@ -5,4 +5,5 @@ app_name = 'core'
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('media-resize/<int:width>x<int:height>/<path:name>', views.media_resize, name='media_resize'),
 ]
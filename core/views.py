@@ -1,26 +1,38 @@
+import os
+
+from django.http import FileResponse, Http404, HttpResponseNotModified
 from django.shortcuts import render
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
 from .models import HeroBanner
-from products.models import Category, Product
+from products.category_tree import category_tree
+from products.models import ProductCard
+from .media_resize import ResizeError, get_resized
+from . import sitemap_files
+from .storage import is_content_addressed
+from .page_cache import cache_anonymous_page
 
+@cache_anonymous_page('home')
 def home(request):
     """Homepage view"""
     # Get active hero banners
     banners = HeroBanner.objects.filter(is_active=True).order_by('order')
     
     # Get featured categories (top 3 for now, or add a featured flag to Category)
-    categories = Category.objects.filter(is_active=True).order_by('order')[:3]
+    categories = category_tree.categories()[:3]
     
     # Get featured products (Best Sellers)
-    featured_products = Product.objects.filter(
+    featured_products = ProductCard.objects.filter(
         is_active=True, 
         is_featured=True
-    ).select_related('category').prefetch_related('images')[:4]
+    )[:4]
     
     # Get new arrivals
-    new_arrivals = Product.objects.filter(
+    new_arrivals = ProductCard.objects.filter(
         is_active=True, 
         is_new_arrival=True
-    ).select_related('category').prefetch_related('images')[:4]
+    )[:4]
     
     context = {
         'banners': banners,
@@ -34,3 +46,66 @@ def robots_txt(request):
     scheme = request.scheme
     domain = request.get_host()
     return render(request, 'robots.txt', {'scheme': scheme, 'domain': domain}, content_type="text/plain")
+
+
+def _open_resized(name, width, height, path):
+    try:
+        return open(path, 'rb')
+    except FileNotFoundError:
+        pass
+    # Evicted by the size cap since get_resized() returned: render it again
+    try:
+        _, path = get_resized(name, width, height)
+        return open(path, 'rb')
+    except (ResizeError, FileNotFoundError):
+        raise Http404("No such image")
+
+
+@require_safe
+def media_resize(request, width, height, name):
+    """Serve a media image scaled to fit within width x height (see core.media_resize)"""
+    try:
+        key, path = get_resized(name, width, height)
+    except ResizeError:
+        raise Http404("No such image")
+
+    etag = f'"{key}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(_open_resized(name, width, height, path), content_type='image/webp')
+    response['ETag'] = etag
+    if is_content_addressed(name):
+        # The name covers the source content, so the URL's image never changes
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        # Legacy names can be overwritten; the ETag makes revalidation cheap
+        response['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+
+def _sitemap_response(request, path, etag_prefix):
+    """Serve a sitemap file, or 304 if the crawler's copy is current"""
+    stat = os.stat(path)
+    etag = f'"{etag_prefix}-{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = FileResponse(open(path, 'rb'), content_type='application/xml')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+
+@require_safe
+def sitemap_index(request):
+    return _sitemap_response(request, sitemap_files.get_file(), 'index')
+
+
+@require_safe
+def sitemap_section(request, section):
+    path = sitemap_files.get_file(section)
+    if path is None:
+        raise Http404("No such sitemap")
+    return _sitemap_response(request, path, section)
@@ -8,11 +8,11 @@ class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
     can_delete = False
-    fields = ('product', 'variant_info', 'quantity', 'price', 'subtotal')
-    readonly_fields = ('product', 'variant_info', 'quantity', 'price', 'subtotal')
+    fields = ('product_name', 'sku', 'variant_info', 'quantity', 'price', 'subtotal')
+    readonly_fields = ('product_name', 'sku', 'variant_info', 'quantity', 'price', 'subtotal')
 
     def variant_info(self, obj):
-        return obj.variant_details if obj.variant else "N/A"
+        return obj.variant_details
     variant_info.short_description = 'Size / Color'
 
     def has_add_permission(self, request, obj=None):
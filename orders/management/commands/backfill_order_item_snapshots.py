@@ -0,0 +1,69 @@
+from urllib.parse import unquote
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from orders.models import THUMBNAIL_DIR, OrderItem, keep_thumbnail
+from products.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = "Copy product details onto order items placed before they were snapshotted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--thumbnails', action='store_true',
+            help="Also copy thumbnails that still point at product images, which get garbage collected",
+        )
+
+    def handle(self, *args, batch_size, thumbnails, **options):
+        pending = (
+            OrderItem.objects.filter(product_name='', product__isnull=False)
+            .select_related('product', 'variant')
+            .prefetch_related(Prefetch('product__images', queryset=ProductImage.objects.all()))
+            .order_by('pk')
+        )
+        total = 0
+        last_pk = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            for item in batch:
+                item.take_snapshot()
+            OrderItem.objects.bulk_update(batch, OrderItem.SNAPSHOT_FIELDS)
+            total += len(batch)
+            last_pk = batch[-1].pk
+        self.stdout.write(self.style.SUCCESS(f"Snapshotted {total} order items"))
+        if thumbnails:
+            self.copy_thumbnails(batch_size)
+
+    def copy_thumbnails(self, batch_size):
+        base_url = default_storage.base_url
+        pending = (
+            OrderItem.objects.filter(thumbnail_url__startswith=base_url)
+            .exclude(thumbnail_url__startswith=f'{base_url}{THUMBNAIL_DIR}/')
+            .only('thumbnail_url').order_by('pk')
+        )
+        copied = {}
+        total = 0
+        last_pk = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            updated = []
+            for item in batch:
+                url = item.thumbnail_url
+                if url not in copied:
+                    copied[url] = keep_thumbnail(unquote(url[len(base_url):]))
+                # A source that is already gone keeps its (broken) URL
+                if copied[url]:
+                    item.thumbnail_url = copied[url]
+                    updated.append(item)
+            OrderItem.objects.bulk_update(updated, ['thumbnail_url'])
+            total += len(updated)
+        self.stdout.write(self.style.SUCCESS(f"Copied the thumbnails of {total} order items"))
@@ -0,0 +1,65 @@
+# Generated by Django 5.0.14 on 2026-10-18 16:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0002_ordernumbercounter"),
+        ("products", "0006_stockreservation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="orderitem",
+            name="color",
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name="orderitem",
+            name="product_name",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="orderitem",
+            name="product_slug",
+            field=models.SlugField(blank=True, db_index=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="orderitem",
+            name="size",
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name="orderitem",
+            name="sku",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="orderitem",
+            name="thumbnail_url",
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AlterField(
+            model_name="orderitem",
+            name="product",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="products.product",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="orderitem",
+            name="variant",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="products.productvariant",
+            ),
+        ),
+    ]
@@ -1,7 +1,12 @@
+import hashlib
+import posixpath
+
+from django.core.files.storage import default_storage
 from django.db import models
 from django.core.validators import MinValueValidator
+from core.images import smallest_derivative
 from products.models import Product, ProductVariant
-import uuid
+from .numbering import next_order_number
 
 
 class Order(models.Model):
@@ -60,10 +65,7 @@ class Order(models.Model):
     @staticmethod
     def generate_order_number():
         """Generate unique order number with format: ORD-YYYYMMDD-XXXX"""
-        from datetime import datetime
-        date_str = datetime.now().strftime('%Y%m%d')
-        unique_id = str(uuid.uuid4().hex)[:6].upper()
-        return f"ORD-{date_str}-{unique_id}"
+        return next_order_number()
 
     @property
     def item_count(self):
@@ -71,32 +73,100 @@ class Order(models.Model):
         return sum(item.quantity for item in self.items.all())
 
 
+class OrderNumberCounter(models.Model):
+    """Last order number handed out each day, where there is no sequence"""
+    day = models.DateField(primary_key=True)
+    value = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.day}: {self.value}"
+
+
+# Copies of the images order lines show, see keep_thumbnail()
+THUMBNAIL_DIR = 'order-thumbnails'
+
+
+def keep_thumbnail(name):
+    """URL of a copy of media file ``name`` for order lines to show.
+
+    Product images are garbage collected once no product uses them (see
+    core.storage), but orders must keep showing them, so lines point at a
+    copy outside the collected directories. Copies are named after the
+    source, which never changes content, so each is written once.
+    Returns '' if the source is missing.
+    """
+    extension = posixpath.splitext(name)[1].lower()
+    target = f'{THUMBNAIL_DIR}/{hashlib.sha256(name.encode()).hexdigest()[:32]}{extension}'
+    if not default_storage.exists(target):
+        try:
+            with default_storage.open(name) as source:
+                target = default_storage.save(target, source)
+        except OSError:
+            return ''
+    return default_storage.url(target)
+
+
 class OrderItem(models.Model):
-    """Order item model - individual products in an order"""
+    """Order item model - individual products in an order.
+
+    Orders never change after purchase, so each line keeps a snapshot of the
+    product as it was sold; rendering an order needs no joins and survives
+    products being renamed or deleted.
+    """
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
-    product = models.ForeignKey(Product, on_delete=models.PROTECT)
-    variant = models.ForeignKey(ProductVariant, on_delete=models.PROTECT, null=True, blank=True)
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True)
+    variant = models.ForeignKey(ProductVariant, on_delete=models.SET_NULL, null=True, blank=True)
     quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)], 
                                  help_text="Price at time of purchase")
     subtotal = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
 
+    # Snapshot at time of purchase
+    product_name = models.CharField(max_length=255, blank=True)
+    product_slug = models.SlugField(max_length=255, blank=True, db_index=False)
+    sku = models.CharField(max_length=100, blank=True)
+    size = models.CharField(max_length=10, blank=True)
+    color = models.CharField(max_length=50, blank=True)
+    thumbnail_url = models.CharField(max_length=500, blank=True)
+
+    SNAPSHOT_FIELDS = ['product_name', 'product_slug', 'sku', 'size', 'color', 'thumbnail_url']
+
     class Meta:
         indexes = [
             models.Index(fields=['order']),
         ]
 
     def __str__(self):
-        return f"{self.product.name} x {self.quantity}"
+        return f"{self.product_name} x {self.quantity}"
 
     def save(self, *args, **kwargs):
         # Auto-calculate subtotal
         self.subtotal = self.price * self.quantity
+        if not self.product_name and self.product:
+            self.take_snapshot()
         super().save(*args, **kwargs)
 
+    def take_snapshot(self):
+        """Copy the product and variant details onto the line"""
+        product, variant = self.product, self.variant
+        if product is not None:
+            image = product.primary_image
+            self.product_name = product.name
+            self.product_slug = product.slug
+            self.thumbnail_url = self._thumbnail_url(image) if image else ''
+        if variant is not None:
+            self.sku = variant.sku
+            self.size = variant.size
+            self.color = variant.color
+
+    @staticmethod
+    def _thumbnail_url(image):
+        # The smallest derivative (160px JPEG) rather than the full upload
+        return keep_thumbnail(smallest_derivative(image.image_derivatives) or image.image.name)
+
     @property
     def variant_details(self):
         """Get variant size and color for display"""
-        if self.variant:
-            return f"{self.variant.size} / {self.variant.color}"
+        if self.size or self.color:
+            return f"{self.size} / {self.color}"
         return "N/A"
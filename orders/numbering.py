@@ -0,0 +1,52 @@
+"""Order numbers: ``ORD-YYYYMMDD-NNNN``.
+
+Numbers come from the database, never from random ids, so they cannot
+collide and no retry loop is needed however many workers are placing
+orders at once.
+
+* On PostgreSQL they come from the ``orders_order_number_seq`` sequence
+  (created by migration). ``nextval`` is atomic across connections and is
+  not rolled back, so concurrent checkouts never wait on each other; the
+  counter does not restart each day and gaps are possible.
+* Elsewhere (SQLite in development and tests) a per-day
+  ``OrderNumberCounter`` row is incremented with one upsert; SQLite
+  serializes writers, so the numbers are gap-free and restart each day.
+"""
+from django.db import connection
+from django.utils import timezone
+
+SEQUENCE_NAME = 'orders_order_number_seq'
+
+
+def _next_from_sequence(day):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT nextval(%s)', [SEQUENCE_NAME])
+        return cursor.fetchone()[0]
+
+
+def _next_from_counter(day):
+    from .models import OrderNumberCounter
+
+    meta = OrderNumberCounter._meta
+    qn = connection.ops.quote_name
+    table, day_col, value_col = (
+        qn(meta.db_table), qn(meta.get_field('day').column), qn(meta.get_field('value').column)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({day_col}, {value_col}) VALUES (%s, 1) '
+            f'ON CONFLICT ({day_col}) DO UPDATE SET {value_col} = {table}.{value_col} + 1 '
+            f'RETURNING {value_col}',
+            [connection.ops.adapt_datefield_value(day)],
+        )
+        return cursor.fetchone()[0]
+
+
+def next_order_number():
+    """Hand out the next order number"""
+    day = timezone.localdate()
+    if connection.vendor == 'postgresql':
+        number = _next_from_sequence(day)
+    else:
+        number = _next_from_counter(day)
+    return f"ORD-{day:%Y%m%d}-{number:04d}"
@@ -0,0 +1,198 @@
+"""Order placement helpers."""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from products.models import ProductVariant, StockReservation, reserved_quantity
+from products.signals import products_updated, stock_changed
+
+from .models import OrderItem
+
+
+class InsufficientStock(Exception):
+    """Some lines could not be taken out of stock.
+
+    ``available`` maps each failed variant id to the stock it has left.
+    """
+
+    def __init__(self, available):
+        super().__init__(available)
+        self.available = available
+
+
+def _lock_variants(variant_ids):
+    """Lock variant rows in primary key order so concurrent checkouts sharing
+    variants cannot deadlock (SQLite has no SELECT ... FOR UPDATE)"""
+    if connection.features.has_select_for_update:
+        list(
+            ProductVariant.objects.select_for_update()
+            .filter(pk__in=variant_ids).order_by('pk').values_list('pk', flat=True)
+        )
+
+
+def _available(variant_ids, cart_id, now=None):
+    """Stock left for ``cart_id`` once other carts' reservations are held back"""
+    return dict(
+        ProductVariant.objects.filter(pk__in=variant_ids, is_available=True)
+        .annotate(left=F('stock_quantity') - reserved_quantity(exclude_cart_id=cart_id, now=now))
+        .values_list('pk', 'left')
+    )
+
+
+def reserve_stock(cart_id, quantities):
+    """Hold ``{variant_id: quantity}`` for a cart while it checks out.
+
+    Replaces the cart's earlier reservations and holds the stock for
+    ``settings.STOCK_RESERVATION_MINUTES``. Lines that cannot be held in full
+    are not reserved; they are returned as ``{variant_id: available}``.
+    """
+    variant_ids = sorted(quantities)
+    expires_at = timezone.now() + timedelta(minutes=settings.STOCK_RESERVATION_MINUTES)
+    short = {}
+    with transaction.atomic():
+        _lock_variants(variant_ids)
+        StockReservation.objects.filter(cart_id=cart_id).delete()
+        available = _available(variant_ids, cart_id)
+
+        reservations = []
+        exhausted = []
+        for variant_id in variant_ids:
+            left = available.get(variant_id, 0)
+            if left < quantities[variant_id]:
+                short[variant_id] = max(left, 0)
+                continue
+            reservations.append(StockReservation(
+                variant_id=variant_id, cart_id=cart_id,
+                quantity=quantities[variant_id], expires_at=expires_at,
+            ))
+            if left == quantities[variant_id]:
+                exhausted.append(variant_id)
+        StockReservation.objects.bulk_create(reservations)
+
+        # Cards and pages only change when a variant stops being available
+        if exhausted:
+            products_updated(
+                ProductVariant.objects.filter(pk__in=exhausted).values_list('product_id', flat=True),
+                variants=True,
+            )
+    return short
+
+
+class _Short(Exception):
+    pass
+
+
+# Retries when stock is released while decrementing, before giving up
+DECREMENT_ATTEMPTS = 3
+
+
+def decrement_stock(quantities, cart_id=None):
+    """Take ``{variant_id: quantity}`` out of stock, all or nothing.
+
+    Must run inside a transaction. All lines are decremented by a single
+    conditional UPDATE that leaves other carts' reservations untouched, so
+    stock is never oversold even where row locks are unavailable and the
+    cost does not grow with the number of lines. The cart's own
+    reservations are released once its stock is taken.
+
+    Returns the ids of the variants in stock before the decrement and of
+    those in stock after it, for ``products.signals.stock_changed``.
+    """
+    if not quantities:
+        return set(), set()
+    variant_ids = sorted(quantities)
+    _lock_variants(variant_ids)
+
+    taken = Case(*(
+        When(pk=variant_id, then=Value(quantity)) for variant_id, quantity in quantities.items()
+    ))
+
+    for attempt in range(DECREMENT_ATTEMPTS):
+        # The UPDATE and the shortfall check must agree on which
+        # reservations are still active, so both use the same instant
+        now = timezone.now()
+        reserved = reserved_quantity(exclude_cart_id=cart_id, now=now)
+        enough = Q()
+        for variant_id in variant_ids:
+            enough |= Q(pk=variant_id, stock_quantity__gte=reserved + quantities[variant_id])
+        try:
+            with transaction.atomic():
+                updated = ProductVariant.objects.filter(enough, is_available=True).update(
+                    stock_quantity=F('stock_quantity') - taken, updated_at=now
+                )
+                if updated != len(variant_ids):
+                    # Undo the lines that did fit
+                    raise _Short
+        except _Short:
+            available = _available(variant_ids, cart_id, now)
+            short = {
+                pk: max(available.get(pk, 0), 0) for pk in variant_ids
+                if available.get(pk, 0) < quantities[pk]
+            }
+            if short:
+                raise InsufficientStock(short)
+            # Stock was released in between; try again
+        else:
+            break
+    else:
+        raise InsufficientStock({pk: max(available.get(pk, 0), 0) for pk in variant_ids})
+
+    held = {}
+    if cart_id:
+        reservations = StockReservation.objects.filter(cart_id=cart_id)
+        held = dict(reservations.active(now).filter(variant__in=variant_ids).values_list('variant_id', 'quantity'))
+        reservations.delete()
+
+    # Worked out backwards from the stock left, so that nothing is read
+    # before the UPDATE (a read first would make SQLite writers deadlock)
+    left = _available(variant_ids, None)
+    in_stock_before = {pk for pk in left if left[pk] + quantities[pk] - held.get(pk, 0) > 0}
+    in_stock_after = {pk for pk in left if left[pk] > 0}
+    return in_stock_before, in_stock_after
+
+
+def place_order(cart, form):
+    """Turn a checkout form and the cart into an order.
+
+    The cart is resolved once and the stock, the order total and every
+    ``OrderItem`` come from those same lines; items are written with one
+    ``bulk_create``, so the number of queries does not grow with the cart.
+    Raises ``InsufficientStock`` (leaving nothing written) if a line can't
+    be fulfilled.
+    """
+    items = list(cart)
+    with transaction.atomic():
+        in_stock_before, in_stock_after = decrement_stock({
+            item['variant_id']: item['quantity'] for item in items if item['variant']
+        }, cart_id=cart.storage.cart_id)
+        order = form.save(commit=False)
+        order.total_amount = sum((item['total_price'] for item in items), Decimal('0'))
+        order.save()
+        order_items = []
+        for item in items:
+            order_item = OrderItem(
+                order=order,
+                product=item['product'],
+                variant=item['variant'],
+                quantity=item['quantity'],
+                price=item['price'],
+                subtotal=item['total_price'],
+            )
+            # Cart products come with their card image, so this is free
+            order_item.take_snapshot()
+            order_items.append(order_item)
+        OrderItem.objects.bulk_create(order_items)
+
+    # The stock UPDATEs bypass the model signals. Cards, listings and
+    # cached pages only change when a variant sells out (or, with the
+    # cart's reservation released, comes back); otherwise only the
+    # products' variant matrices are refreshed.
+    stock_changed(
+        {item['variant_id']: item['product_id'] for item in items if item['variant']},
+        in_stock_before, in_stock_after,
+    )
+    return order
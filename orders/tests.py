@@ -1,3 +1,246 @@
-from django.test import TestCase
+import io
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, transaction, OperationalError
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from core.storage import is_content_addressed
+from products.models import Category, Product, ProductImage, ProductVariant, StockReservation
+from .models import Order, OrderItem
+from .numbering import next_order_number
+from .services import InsufficientStock, decrement_stock
+
+CHECKOUT_DATA = {
+    'customer_name': 'Test Customer',
+    'phone': '123456',
+    'email': 'test@example.com',
+    'address': '1 Test Street',
+    'city': 'Test City',
+    'postal_code': '12345',
+}
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        category = Category.objects.create(name='Tops', slug='tops')
+        self.product = Product.objects.create(
+            name='Tee', slug='tee', category=category, description='Test', base_price=10,
+        )
+        self.variant = ProductVariant.objects.create(
+            product=self.product, size='M', color='Blue', stock_quantity=3,
+        )
+
+    def add_to_cart(self, quantity, client=None):
+        (client or self.client).post(reverse('cart:add'), {
+            'product_id': self.product.id, 'quantity': quantity, 'size': 'M', 'color': 'Blue',
+        })
+
+    def test_checkout_decrements_stock(self):
+        self.add_to_cart(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('orders:checkout'), CHECKOUT_DATA)
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('orders:confirmation', args=[order.order_number]))
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock_quantity, 1)
+        self.assertEqual(order.total_amount, 20)
+
+    def test_orders_only_purge_listings_when_a_variant_sells_out(self):
+        cache.clear()
+        shop = reverse('products:shop')
+        Client().get(shop)
+        self.assertEqual(self.product.variant_matrix().stock('M', 'Blue'), 3)
+        self.add_to_cart(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('orders:checkout'), CHECKOUT_DATA)
+        self.assertEqual(Client().get(shop)['X-Page-Cache'], 'hit')
+        # The product's stock levels are refreshed all the same
+        self.assertEqual(self.product.variant_matrix().stock('M', 'Blue'), 2)
+
+        buyer = Client()
+        self.add_to_cart(2, client=buyer)
+        with self.captureOnCommitCallbacks(execute=True):
+            buyer.post(reverse('orders:checkout'), CHECKOUT_DATA)
+        self.assertEqual(Client().get(shop)['X-Page-Cache'], 'miss')
+        self.assertFalse(Product.objects.for_cards().get().in_stock)
+
+    def test_short_stock_is_reported_per_line(self):
+        self.add_to_cart(5)
+        response = self.client.post(reverse('orders:checkout'), CHECKOUT_DATA)
+        self.assertContains(response, 'Only 3 left of Tee (M / Blue)')
+        self.assertFalse(Order.objects.exists())
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock_quantity, 3)
+
+    def test_order_lines_keep_a_snapshot_of_the_product(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        small = default_storage.save('derivatives/products/tee/160w.jpg', ContentFile(b'small'))
+        ProductImage.objects.create(product=self.product, image='products/tee.jpg', is_primary=True, image_derivatives={
+            'jpeg': [[160, small], [320, 'derivatives/products/tee/320w.jpg']],
+        })
+        self.add_to_cart(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('orders:checkout'), CHECKOUT_DATA)
+        order = Order.objects.get()
+        item = order.items.get()
+        self.assertEqual((item.product_name, item.size, item.color), ('Tee', 'M', 'Blue'))
+        self.assertEqual(item.sku, self.variant.sku)
+        # A copy of the smallest derivative, which media garbage collection
+        # never removes once the product image is gone
+        self.assertTrue(item.thumbnail_url.startswith(default_storage.url('order-thumbnails/')))
+        copy = item.thumbnail_url[len(default_storage.base_url):]
+        with default_storage.open(copy) as f:
+            self.assertEqual(f.read(), b'small')
+        self.assertFalse(is_content_addressed(copy))
+
+        # Lines snapshotted before copies existed are copied by the backfill
+        OrderItem.objects.update(thumbnail_url=default_storage.url(small))
+        call_command('backfill_order_item_snapshots', thumbnails=True, stdout=io.StringIO())
+        item.refresh_from_db()
+        self.assertEqual(item.thumbnail_url, default_storage.url(copy))
+
+        # Lines placed before snapshots existed are filled in by the backfill
+        OrderItem.objects.update(product_name='', sku='')
+        call_command('backfill_order_item_snapshots', stdout=io.StringIO())
+        item.refresh_from_db()
+        self.assertEqual((item.product_name, item.sku), ('Tee', self.variant.sku))
+
+        self.product.delete()
+        url = reverse('orders:confirmation', args=[order.order_number])
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertContains(response, 'Tee')
+        self.assertContains(response, 'M | Blue')
+
+    def checkout_queries(self, colors):
+        client = Client()
+        for color in colors:
+            client.post(reverse('cart:add'), {
+                'product_id': self.product.id, 'quantity': 1, 'size': 'S', 'color': color,
+            })
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = client.post(reverse('orders:checkout'), CHECKOUT_DATA)
+        self.assertEqual(response.status_code, 302)
+        return len(queries)
+
+    def test_checkout_queries_do_not_grow_with_the_cart(self):
+        colors = ['Red', 'Green', 'Black', 'White', 'Grey']
+        for color in colors:
+            ProductVariant.objects.create(product=self.product, size='S', color=color, stock_quantity=5)
+        self.assertEqual(self.checkout_queries(colors[:1]), self.checkout_queries(colors))
+        order = Order.objects.latest('pk')
+        self.assertEqual(order.items.count(), 5)
+        self.assertEqual(order.total_amount, 50)
+
+    def test_opening_checkout_holds_stock_for_the_cart(self):
+        self.add_to_cart(3)
+        self.client.get(reverse('orders:checkout'))
+        self.assertEqual(StockReservation.objects.get().quantity, 3)
+        self.assertFalse(ProductVariant.objects.get().in_stock)
+        self.assertFalse(Product.objects.for_cards().get().in_stock)
+
+        # Another customer learns before filling in the form
+        other = Client()
+        self.add_to_cart(1, client=other)
+        response = other.get(reverse('orders:checkout'))
+        self.assertContains(response, 'Tee (M / Blue) is sold out.')
+
+        # The holder can still buy, which releases the reservation
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('orders:checkout'), CHECKOUT_DATA)
+        self.assertTrue(Order.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock_quantity, 0)
+
+    def test_sweeper_releases_expired_reservations(self):
+        self.add_to_cart(3)
+        self.client.get(reverse('orders:checkout'))
+        StockReservation.objects.update(expires_at=timezone.now())
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('expire_stock_reservations', stdout=io.StringIO())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertTrue(ProductVariant.objects.get().in_stock)
+
+    def test_decrement_gives_up_if_stock_keeps_disagreeing(self):
+        other_cart = StockReservation.objects.create(
+            variant=self.variant, cart_id='other', quantity=3,
+            expires_at=timezone.now() + timedelta(minutes=5),
+        )
+        # The shortfall check never finds the shortage the UPDATE runs into
+        with mock.patch('orders.services._available', return_value={self.variant.pk: 3}) as available, \
+                self.assertRaises(InsufficientStock), transaction.atomic():
+            decrement_stock({self.variant.pk: 1})
+        self.assertEqual(available.call_count, 3)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock_quantity, 3)
+        self.assertTrue(StockReservation.objects.filter(pk=other_cart.pk).exists())
+
+
+class OrderNumberTests(TestCase):
+    def test_numbers_increase_per_day(self):
+        prefix = f"ORD-{timezone.localdate():%Y%m%d}-"
+        self.assertEqual(next_order_number(), prefix + '0001')
+        self.assertEqual(next_order_number(), prefix + '0002')
+
+
+class ConcurrentStockTests(TransactionTestCase):
+    def test_no_oversell_under_concurrent_checkouts(self):
+        category = Category.objects.create(name='Tops', slug='tops')
+        product = Product.objects.create(
+            name='Tee', slug='tee', category=category, description='Test', base_price=10,
+        )
+        variant = ProductVariant.objects.create(
+            product=product, size='M', color='Blue', stock_quantity=10,
+        )
+        results = []
+        numbers = []
+        start = threading.Barrier(50)
+
+        def checkout():
+            start.wait()
+            try:
+                while True:
+                    try:
+                        with transaction.atomic():
+                            decrement_stock({variant.pk: 1})
+                            number = next_order_number()
+                        results.append(True)
+                        numbers.append(number)
+                        return
+                    except InsufficientStock:
+                        results.append(False)
+                        return
+                    except OperationalError:
+                        # SQLite reports lock contention instead of waiting
+                        time.sleep(random.uniform(0, 0.02))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        variant.refresh_from_db()
+        self.assertEqual(results.count(True), 10)
+        self.assertEqual(results.count(False), 40)
+        self.assertEqual(variant.stock_quantity, 0)
+        self.assertEqual(len(set(numbers)), 10)
@@ -1,8 +1,25 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import Order, OrderItem
+from .models import Order
 from .forms import CheckoutForm
+from .services import InsufficientStock, place_order, reserve_stock
 from cart.cart import Cart
-from products.models import ProductVariant
+
+
+def _stock_errors(items, available):
+    """One message per cart line that could not be fulfilled"""
+    errors = []
+    for item in items:
+        variant = item['variant']
+        if variant is None or variant.pk not in available:
+            continue
+        name = f"{item['product'].name} ({variant.size} / {variant.color})"
+        left = available[variant.pk]
+        if left:
+            errors.append(f"Only {left} left of {name}; you asked for {item['quantity']}.")
+        else:
+            errors.append(f"{name} is sold out.")
+    return errors
+
 
 def checkout(request):
     """Checkout view"""
@@ -10,49 +27,31 @@ def checkout(request):
     if len(cart) == 0:
         return redirect('cart:detail')
         
+    # Stock is held for this cart from the moment checkout opens
+    cart_id = cart.storage.get_or_create_cart_id()
+    stock_errors = []
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
-            order = form.save(commit=False)
-            order.total_amount = cart.get_total_price()
-            order.save()
-            
-            # Create order items
-            for item in cart:
-                product = item['product']
-                variant_id = item.get('variant_id')
-                variant = None
-                
-                # Check for variant
-                if variant_id:
-                    try:
-                        variant = ProductVariant.objects.get(id=variant_id)
-                        # Basic stock check/update could go here, but omitted for MVP simplicity
-                        # In production we should lock rows or check stock again
-                        variant.stock_quantity -= item['quantity']
-                        variant.save()
-                    except ProductVariant.DoesNotExist:
-                        pass
-                
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    variant=variant,
-                    quantity=item['quantity'],
-                    price=item['price'],
-                    subtotal=item['total_price']
-                )
-            
-            # Clear cart
-            cart.clear()
-            
-            return redirect('orders:confirmation', order_number=order.order_number)
+            try:
+                order = place_order(cart, form)
+            except InsufficientStock as e:
+                stock_errors = _stock_errors(cart, e.available)
+            else:
+                cart.clear()
+                return redirect('orders:confirmation', order_number=order.order_number)
     else:
         form = CheckoutForm()
-        
+        items = list(cart)
+        short = reserve_stock(cart_id, {
+            item['variant_id']: item['quantity'] for item in items if item['variant']
+        })
+        stock_errors = _stock_errors(items, short)
+
     context = {
         'cart': cart,
         'form': form,
+        'stock_errors': stock_errors,
     }
     return render(request, 'pages/checkout.html', context)
 
@@ -1,17 +1,22 @@
 from django.shortcuts import render
+from core.page_cache import cache_anonymous_page
 
+@cache_anonymous_page('pages')
 def about(request):
     """About us page"""
     return render(request, 'pages/about.html')
 
+@cache_anonymous_page('pages')
 def contact(request):
     """Contact page"""
     return render(request, 'pages/contact.html')
 
+@cache_anonymous_page('pages')
 def privacy_policy(request):
     """Privacy policy page"""
     return render(request, 'pages/privacy_policy.html')
 
+@cache_anonymous_page('pages')
 def returns_policy(request):
     """Returns policy page"""
     return render(request, 'pages/returns_policy.html')
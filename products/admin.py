@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from adminsortable2.admin import SortableAdminMixin
-from .models import Category, Product, ProductImage, ProductVariant
+from core.media_resize import resized_url
+from .models import Category, Product, ProductImage, ProductVariant, StockReservation
+from .signals import products_updated
 
 
 class ProductImageInline(admin.TabularInline):
@@ -13,7 +15,7 @@ class ProductImageInline(admin.TabularInline):
 
     def image_preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 100px;" />', obj.image.url)
+            return format_html('<img src="{}" style="max-height: 100px;" />', resized_url(obj.image.name, 200, 200))
         return "No image"
     image_preview.short_description = 'Preview'
 
@@ -36,7 +38,7 @@ class CategoryAdmin(SortableAdminMixin, admin.ModelAdmin):
 
     def image_preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 80px;" />', obj.image.url)
+            return format_html('<img src="{}" style="max-height: 80px;" />', resized_url(obj.image.name, 160, 160))
         return "No image"
     image_preview.short_description = 'Image'
 
@@ -77,20 +79,28 @@ class ProductAdmin(admin.ModelAdmin):
         return format_html('<span style="color: red;">✗ Out of Stock</span>')
     stock_status.short_description = 'Stock'
 
+    def _update_products(self, queryset, **values):
+        # Resolve the selection first: the changelist filters may no longer
+        # match the rows after the update (e.g. deactivating ?is_active=1)
+        pks = list(queryset.values_list('pk', flat=True))
+        Product.objects.filter(pk__in=pks).update(**values)
+        # queryset.update() skips the save signals, so caches are refreshed here
+        products_updated(pks)
+
     def make_active(self, request, queryset):
-        queryset.update(is_active=True)
+        self._update_products(queryset, is_active=True)
     make_active.short_description = "Activate selected products"
 
     def make_inactive(self, request, queryset):
-        queryset.update(is_active=False)
+        self._update_products(queryset, is_active=False)
     make_inactive.short_description = "Deactivate selected products"
 
     def mark_as_featured(self, request, queryset):
-        queryset.update(is_featured=True)
+        self._update_products(queryset, is_featured=True)
     mark_as_featured.short_description = "Mark as featured"
 
     def unmark_as_featured(self, request, queryset):
-        queryset.update(is_featured=False)
+        self._update_products(queryset, is_featured=False)
     unmark_as_featured.short_description = "Remove from featured"
 
 
@@ -103,7 +113,7 @@ class ProductImageAdmin(admin.ModelAdmin):
     
     def image_preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 80px;" />', obj.image.url)
+            return format_html('<img src="{}" style="max-height: 80px;" />', resized_url(obj.image.name, 160, 160))
         return "No image"
     image_preview.short_description = 'Preview'
 
@@ -115,3 +125,13 @@ class ProductVariantAdmin(admin.ModelAdmin):
     list_filter = ('size', 'is_available', 'product__category')
     search_fields = ('product__name', 'sku', 'color')
     list_editable = ('stock_quantity', 'is_available')
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    """Admin for StockReservation model"""
+    list_display = ('variant', 'cart_id', 'quantity', 'expires_at', 'created_at')
+    list_filter = ('expires_at',)
+    search_fields = ('variant__sku', 'variant__product__name', 'cart_id')
+    list_select_related = ('variant__product',)
+    readonly_fields = ('created_at',)
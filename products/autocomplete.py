@@ -0,0 +1,190 @@
+"""Per-process autocomplete index for the HTMX search suggestions.
+
+Product and category names are tokenised into a prefix trie for
+search-as-you-type and into trigram postings for typo tolerance. Lookups
+never touch the database: the only shared state read per keystroke is the
+catalog version counter, and only a changed version triggers a refresh.
+"""
+import heapq
+import re
+import threading
+from collections import namedtuple
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import ProductCard
+from .versioning import CATALOG_DELETES_VERSION, CATALOG_VERSION, get_version
+
+Suggestion = namedtuple(
+    'Suggestion', ['pk', 'slug', 'name', 'image_url', 'image_derivatives', 'base_price',
+                   'created_at', 'updated_at']
+)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Name matches outrank category matches
+NAME_WEIGHT = 2
+CATEGORY_WEIGHT = 1
+# Share of the query's trigrams a token must contain to count as a typo match
+TRIGRAM_THRESHOLD = 0.5
+# updated_at is stamped by the app servers, so allow for clock skew between them
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _TrieNode:
+    __slots__ = ('children', 'ids')
+
+    def __init__(self):
+        self.children = {}
+        # product id -> best field weight of a token passing through this node
+        self.ids = {}
+
+
+class SuggestionIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.entries = {}
+        self.tokens = {}
+        self.root = _TrieNode()
+        self.trigram_postings = {}
+        self.version = None
+        self.deletes_version = None
+        self.synced_at = None
+
+    # Index maintenance
+
+    def _add(self, card):
+        entry = Suggestion(card.pk, card.slug, card.name, card.image_url, card.image_derivatives,
+                           card.base_price, card.created_at.timestamp(), card.updated_at)
+        tokens = {}
+        for token in tokenize(card.category_name):
+            tokens[token] = CATEGORY_WEIGHT
+        for token in tokenize(card.name):
+            tokens[token] = NAME_WEIGHT
+
+        self.entries[card.pk] = entry
+        self.tokens[card.pk] = tokens
+        for token, weight in tokens.items():
+            node = self.root
+            for char in token:
+                node = node.children.setdefault(char, _TrieNode())
+                if node.ids.get(card.pk, 0) < weight:
+                    node.ids[card.pk] = weight
+            for gram in trigrams(token):
+                self.trigram_postings.setdefault(gram, set()).add((card.pk, token))
+
+    def _remove(self, pk):
+        tokens = self.tokens.pop(pk, None)
+        if tokens is None:
+            return
+        del self.entries[pk]
+        for token in tokens:
+            node = self.root
+            for char in token:
+                node = node.children.get(char)
+                if node is None:
+                    break
+                node.ids.pop(pk, None)
+            for gram in trigrams(token):
+                postings = self.trigram_postings.get(gram)
+                if postings is not None:
+                    postings.discard((pk, token))
+
+    def _sync(self):
+        version = get_version(CATALOG_VERSION)
+        deletes_version = get_version(CATALOG_DELETES_VERSION)
+        if version == self.version and self.synced_at is not None:
+            return
+
+        started_at = timezone.now()
+        if self.synced_at is None or deletes_version != self.deletes_version:
+            # Deleted rows leave nothing to diff against, so start over
+            self._reset()
+            cards = ProductCard.objects.filter(is_active=True)
+        else:
+            cards = ProductCard.objects.filter(updated_at__gte=self.synced_at - SYNC_OVERLAP)
+
+        for card in cards.only('pk', 'slug', 'name', 'image_url', 'image_derivatives', 'base_price',
+                               'created_at', 'updated_at', 'category_name', 'is_active').iterator():
+            self._remove(card.pk)
+            if card.is_active:
+                self._add(card)
+
+        self.version = version
+        self.deletes_version = deletes_version
+        self.synced_at = started_at
+
+    # Lookups
+
+    def _prefix_matches(self, query_tokens):
+        scores = None
+        for token in query_tokens:
+            node = self.root
+            for char in token:
+                node = node.children.get(char)
+                if node is None:
+                    return {}
+            if scores is None:
+                # Read only: later tokens build new dicts
+                scores = node.ids
+            else:
+                scores = {pk: score + node.ids[pk] for pk, score in scores.items() if pk in node.ids}
+            if not scores:
+                return {}
+        return scores or {}
+
+    def _fuzzy_matches(self, query_tokens):
+        scores = {}
+        for token in query_tokens:
+            grams = trigrams(token)
+            shared = {}
+            for gram in grams:
+                for posting in self.trigram_postings.get(gram, ()):
+                    shared[posting] = shared.get(posting, 0) + 1
+            # A product scores by its closest token for each query token
+            best = {}
+            for (pk, _), count in shared.items():
+                similarity = count / len(grams)
+                if similarity >= TRIGRAM_THRESHOLD and similarity > best.get(pk, 0):
+                    best[pk] = similarity
+            for pk, similarity in best.items():
+                scores[pk] = scores.get(pk, 0) + similarity
+        return scores
+
+    def suggest(self, query, limit=5):
+        """Return up to ``limit`` Suggestion tuples for ``query``"""
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return []
+        with self._lock:
+            self._sync()
+            scores = self._prefix_matches(query_tokens)
+            # Short prefixes match much of the catalog: keep only the best
+            # ``limit`` rather than sorting every match
+            ranked = heapq.nsmallest(
+                limit, scores, key=lambda pk: (-scores[pk], -self.entries[pk].created_at),
+            )
+            if len(ranked) < limit:
+                fuzzy = self._fuzzy_matches(query_tokens)
+                ranked += heapq.nsmallest(
+                    limit - len(ranked),
+                    (pk for pk in fuzzy if pk not in scores),
+                    key=lambda pk: (-fuzzy[pk], -self.entries[pk].created_at),
+                )
+            return [self.entries[pk] for pk in ranked]
+
+
+suggestion_index = SuggestionIndex()
@@ -0,0 +1,85 @@
+from django.db.models import Prefetch
+
+from .models import Product, ProductCard, ProductVariant
+
+CARD_UPDATE_FIELDS = [
+    'category', 'name', 'slug', 'category_name', 'category_slug',
+    'image_url', 'image_derivatives', 'image_width', 'image_height',
+    'image_placeholder', 'image_alt', 'base_price', 'min_price', 'max_price',
+    'in_stock', 'sizes', 'colors', 'is_active', 'is_featured',
+    'is_new_arrival', 'created_at', 'updated_at',
+]
+
+
+def _card_source():
+    """Products with everything needed to build their cards preloaded"""
+    return Product.objects.for_cards().prefetch_related(
+        Prefetch(
+            'variants',
+            queryset=ProductVariant.objects.in_stock(),
+            to_attr='stocked_variants',
+        )
+    )
+
+
+def build_card(product):
+    """Build an unsaved ProductCard from a product loaded via _card_source()"""
+    image = product.primary_image
+    sizes = sorted({v.size for v in product.stocked_variants})
+    colors = sorted({v.color for v in product.stocked_variants})
+    return ProductCard(
+        product=product,
+        category=product.category,
+        name=product.name,
+        slug=product.slug,
+        category_name=product.category.name,
+        category_slug=product.category.slug,
+        image_url=image.image.url if image else '',
+        image_derivatives=image.image_derivatives if image else {},
+        image_width=image.image_width if image else None,
+        image_height=image.image_height if image else None,
+        image_placeholder=image.image_placeholder if image else '',
+        image_alt=image.alt_text if image else '',
+        base_price=product.base_price,
+        # Variants share the product price for now
+        min_price=product.price,
+        max_price=product.price,
+        in_stock=product.in_stock,
+        sizes=sizes,
+        colors=colors,
+        is_active=product.is_active,
+        is_featured=product.is_featured,
+        is_new_arrival=product.is_new_arrival,
+        created_at=product.created_at,
+    )
+
+
+def _save_cards(cards):
+    ProductCard.objects.bulk_create(
+        cards,
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=CARD_UPDATE_FIELDS,
+    )
+
+
+def refresh_product_cards(product_ids):
+    """Rebuild the cards of the given products; missing products are skipped"""
+    cards = [build_card(p) for p in _card_source().filter(pk__in=list(product_ids))]
+    if cards:
+        _save_cards(cards)
+    return len(cards)
+
+
+def rebuild_product_cards(batch_size=500):
+    """Rebuild every card in primary key batches"""
+    total = 0
+    last_pk = 0
+    while True:
+        batch = list(_card_source().filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not batch:
+            break
+        _save_cards([build_card(p) for p in batch])
+        total += len(batch)
+        last_pk = batch[-1].pk
+    return total
@@ -0,0 +1,48 @@
+"""Process-local copy of the active categories for navigation.
+
+Every page renders the category navigation, so the list is kept in memory
+and reloaded only when the catalog version changes (category and product
+writes bump it, see products.signals). Counts include active products only.
+"""
+import threading
+from collections import namedtuple
+
+from django.db.models import Count, Q
+
+from .models import Category
+from .versioning import CATALOG_VERSION, get_version
+
+CategoryNode = namedtuple(
+    'CategoryNode', ['id', 'name', 'slug', 'order', 'image_url', 'image_derivatives', 'image_width',
+                     'image_height', 'image_placeholder', 'product_count']
+)
+
+
+class CategoryTree:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.nodes = None
+        self.version = None
+
+    def _load(self):
+        categories = Category.objects.filter(is_active=True).annotate(
+            active_products=Count('products', filter=Q(products__is_active=True))
+        ).order_by('order', 'name')
+        return tuple(
+            CategoryNode(c.id, c.name, c.slug, c.order, c.image.url if c.image else '',
+                         c.image_derivatives, c.image_width, c.image_height, c.image_placeholder,
+                         c.active_products)
+            for c in categories
+        )
+
+    def categories(self):
+        """Active categories in display order"""
+        version = get_version(CATALOG_VERSION)
+        with self._lock:
+            if version != self.version or self.nodes is None:
+                self.nodes = self._load()
+                self.version = version
+            return self.nodes
+
+
+category_tree = CategoryTree()
@@ -1,7 +1,9 @@
-from .models import Category
+from .category_tree import category_tree
 
 def categories_processor(request):
     """Add brands/categories to all templates for the navbar"""
+    # Passed uncalled: templates call it on first use, so partials that never
+    # read the categories don't touch the tree at all
     return {
-        'all_categories': Category.objects.filter(is_active=True)
+        'all_categories': category_tree.categories
     }
@@ -0,0 +1,177 @@
+"""Precomputed facet bitsets for filtering the shop page.
+
+For every category (and for the whole catalog) each facet value maps to an
+integer bitmask over that category's active products. Selecting filters is
+then a handful of OR/AND operations and every facet count is a popcount, so
+a filtered page needs no GROUP BY queries. The index also keeps each
+product's sort fields, so a filtered listing is paginated in memory and
+only the rows of the requested page are fetched. The bitsets are rebuilt from
+ProductCard in a single query whenever the catalog version changes.
+"""
+import threading
+from decimal import Decimal
+
+from .models import ProductCard, ProductVariant
+from .versioning import CATALOG_VERSION, get_version
+
+PRICE_BUCKETS = [
+    ('0-25', 'Under $25', Decimal('0'), Decimal('25')),
+    ('25-50', '$25 - $50', Decimal('25'), Decimal('50')),
+    ('50-100', '$50 - $100', Decimal('50'), Decimal('100')),
+    ('100-200', '$100 - $200', Decimal('100'), Decimal('200')),
+    ('200+', '$200 & above', Decimal('200'), None),
+]
+SIZE_ORDER = [code for code, _ in ProductVariant.SIZE_CHOICES]
+
+# facet name -> (query parameter, label)
+FACETS = {
+    'size': ('size', 'Size'),
+    'color': ('color', 'Color'),
+    'price': ('price', 'Price'),
+    'availability': ('in_stock', 'Availability'),
+}
+
+
+def price_bucket(price):
+    for key, _, low, high in PRICE_BUCKETS:
+        if price >= low and (high is None or price < high):
+            return key
+    return None
+
+
+def parse_selection(params):
+    """Read the selected facet values from a QueryDict"""
+    selection = {}
+    for facet, (param, _) in FACETS.items():
+        values = [v for v in params.getlist(param) if v]
+        if facet == 'availability' and values:
+            values = ['in_stock']
+        if values:
+            selection[facet] = set(values)
+    return selection
+
+
+def _iter_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class FacetResult:
+    def __init__(self, product_ids, counts, selection, sort_keys=None):
+        self.product_ids = product_ids
+        self.counts = counts
+        self.selection = selection
+        # pk -> values of the shop sort fields, see pagination.paginate_keys
+        self.sort_keys = sort_keys or {}
+
+    def groups(self):
+        """Facet groups with their values and counts, ready for the template"""
+        price_labels = {key: label for key, label, _, _ in PRICE_BUCKETS}
+        orderings = {
+            'size': lambda v: SIZE_ORDER.index(v) if v in SIZE_ORDER else len(SIZE_ORDER),
+            'price': [key for key, _, _, _ in PRICE_BUCKETS].index,
+        }
+        groups = []
+        for facet, (param, label) in FACETS.items():
+            counts = self.counts.get(facet, {})
+            selected = self.selection.get(facet, set())
+            values = [v for v in counts if counts[v] or v in selected]
+            values.sort(key=orderings.get(facet, str.lower))
+            groups.append({
+                'name': facet,
+                'param': param,
+                'label': label,
+                'values': [{
+                    'value': '1' if facet == 'availability' else value,
+                    'label': price_labels.get(value, 'In stock only' if facet == 'availability' else value),
+                    'count': counts[value],
+                    'selected': value in selected,
+                } for value in values],
+            })
+        return [group for group in groups if group['values']]
+
+
+class FacetSet:
+    """Facet bitmasks over one group of products"""
+
+    def __init__(self):
+        self.product_ids = []
+        self.sort_keys = []
+        self.masks = {facet: {} for facet in FACETS}
+
+    def add(self, pk, values_by_facet, sort_key):
+        bit = 1 << len(self.product_ids)
+        self.product_ids.append(pk)
+        self.sort_keys.append(sort_key)
+        for facet, values in values_by_facet.items():
+            masks = self.masks[facet]
+            for value in values:
+                masks[value] = masks.get(value, 0) | bit
+
+    def select(self, selection):
+        everything = (1 << len(self.product_ids)) - 1
+        selected_masks = {}
+        for facet, values in selection.items():
+            mask = 0
+            for value in values:
+                mask |= self.masks[facet].get(value, 0)
+            selected_masks[facet] = mask
+
+        matched = everything
+        for mask in selected_masks.values():
+            matched &= mask
+
+        # Each facet is counted against the other facets' filters only, so
+        # picking one size still shows how many products the other sizes have.
+        counts = {}
+        for facet, masks in self.masks.items():
+            others = everything
+            for other, mask in selected_masks.items():
+                if other != facet:
+                    others &= mask
+            counts[facet] = {value: (mask & others).bit_count() for value, mask in masks.items()}
+
+        matched = list(_iter_bits(matched))
+        product_ids = [self.product_ids[i] for i in matched]
+        sort_keys = {self.product_ids[i]: self.sort_keys[i] for i in matched}
+        return FacetResult(product_ids, counts, selection, sort_keys)
+
+
+class FacetIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sets = {}
+        self.version = None
+
+    def _rebuild(self):
+        sets = {None: FacetSet()}
+        cards = ProductCard.objects.filter(is_active=True).values_list(
+            'pk', 'category_id', 'sizes', 'colors', 'in_stock', 'base_price', 'created_at'
+        )
+        for pk, category_id, sizes, colors, in_stock, base_price, created_at in cards.iterator():
+            values = {
+                'size': sizes,
+                'color': colors,
+                'price': [price_bucket(base_price)],
+                'availability': ['in_stock'] if in_stock else [],
+            }
+            # The fields of the shop orderings, for paginating matches in memory
+            sort_key = {'pk': pk, 'base_price': base_price, 'created_at': created_at}
+            sets[None].add(pk, values, sort_key)
+            sets.setdefault(category_id, FacetSet()).add(pk, values, sort_key)
+        self.sets = sets
+
+    def select(self, category_id, selection):
+        """Return the FacetResult for a category (None for the whole shop)"""
+        with self._lock:
+            version = get_version(CATALOG_VERSION)
+            if version != self.version or not self.sets:
+                self._rebuild()
+                self.version = version
+            facet_set = self.sets.get(category_id) or FacetSet()
+            return facet_set.select(selection)
+
+
+facet_index = FacetIndex()
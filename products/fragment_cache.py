@@ -0,0 +1,86 @@
+"""Versioned caching of rendered template fragments.
+
+Keys are built from the values a fragment varies on (for product cards,
+the card's primary key and ``updated_at``) plus any named version counters
+(see products.versioning), so model signals invalidate fragments simply by
+changing those values; the timeout only bounds how long orphaned entries
+linger.
+"""
+import hashlib
+import threading
+from collections import Counter
+
+from django.core.cache import cache
+
+from .versioning import get_version
+
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+STATS_NAMES_KEY = 'fragment-stats:names'
+
+
+def fragment_key(name, vary_on=(), versions=()):
+    parts = [str(value) for value in vary_on]
+    parts += [f'{version}={get_version(version)}' for version in versions]
+    digest = hashlib.md5(':'.join(parts).encode(), usedforsecurity=False).hexdigest()
+    return f'fragment:{name}:{digest}'
+
+
+class FragmentStats:
+    """Hit/miss counters per fragment name.
+
+    Events are counted in-process and flushed to the shared cache in
+    batches, so counting does not add a cache round trip per fragment.
+    """
+    flush_every = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = Counter()
+
+    def record(self, name, hit):
+        with self._lock:
+            self._pending[(name, 'hits' if hit else 'misses')] += 1
+            if sum(self._pending.values()) < self.flush_every:
+                return
+            pending, self._pending = self._pending, Counter()
+        self._flush(pending)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        self._flush(pending)
+
+    def _flush(self, pending):
+        names = set(cache.get(STATS_NAMES_KEY) or ())
+        for (name, kind), count in pending.items():
+            key = f'fragment-stats:{name}:{kind}'
+            cache.add(key, 0, timeout=None)
+            cache.incr(key, count)
+            names.add(name)
+        cache.set(STATS_NAMES_KEY, sorted(names), timeout=None)
+
+    def snapshot(self):
+        """Return ``{name: (hits, misses)}`` as recorded in the shared cache"""
+        stats = {}
+        for name in cache.get(STATS_NAMES_KEY) or ():
+            stats[name] = (
+                cache.get(f'fragment-stats:{name}:hits', 0),
+                cache.get(f'fragment-stats:{name}:misses', 0),
+            )
+        return stats
+
+
+fragment_stats = FragmentStats()
+
+
+def render_fragment(name, render, vary_on=(), versions=()):
+    """Return the cached fragment, rendering and storing it on a miss"""
+    key = fragment_key(name, vary_on, versions)
+    content = cache.get(key)
+    if content is None:
+        content = render()
+        cache.set(key, content, FRAGMENT_TIMEOUT)
+        fragment_stats.record(name, hit=False)
+    else:
+        fragment_stats.record(name, hit=True)
+    return content
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products.models import ProductVariant, StockReservation
+from products.signals import stock_changed
+
+
+def expire_reservations():
+    """Delete expired reservations in bulk; returns how many were removed"""
+    with transaction.atomic():
+        expired = StockReservation.objects.expired()
+        variant_products = dict(expired.values_list('variant_id', 'variant__product_id'))
+        if not variant_products:
+            return 0
+        variants = ProductVariant.objects.filter(pk__in=list(variant_products))
+        in_stock_before = set(variants.in_stock().values_list('pk', flat=True))
+        deleted, _ = expired.delete()
+        # Released stock can bring variants back into stock
+        stock_changed(variant_products, in_stock_before, set(variants.in_stock().values_list('pk', flat=True)))
+    return deleted
+
+
+class Command(BaseCommand):
+    help = "Release stock held by checkout reservations that have expired"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', type=int, default=0, metavar='SECONDS',
+            help="Keep sweeping every SECONDS instead of running once",
+        )
+
+    def handle(self, *args, loop, **options):
+        while True:
+            deleted = expire_reservations()
+            self.stdout.write(self.style.SUCCESS(f"Expired {deleted} stock reservations"))
+            if not loop:
+                break
+            time.sleep(loop)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from products.fragment_cache import fragment_stats
+
+
+class Command(BaseCommand):
+    help = "Show hit/miss counters of the template fragment cache"
+
+    def handle(self, *args, **options):
+        stats = fragment_stats.snapshot()
+        if not stats:
+            self.stdout.write("No fragment cache activity recorded yet")
+            return
+        for name, (hits, misses) in sorted(stats.items()):
+            total = hits + misses
+            rate = hits / total * 100 if total else 0
+            self.stdout.write(f"{name:<24} hits={hits:<8} misses={misses:<8} hit rate={rate:.1f}%")
@@ -0,0 +1,66 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+
+from core.images import IMAGE_FIELDS, ImageDerivativesMixin, process_image
+from products.cards import rebuild_product_cards
+from products.versioning import CATALOG_STRUCTURE_VERSION, CATALOG_VERSION, bump_version
+
+
+def _init_worker():
+    # Spawned (rather than forked) workers start without Django configured
+    if not apps.ready:
+        django.setup()
+
+
+class Command(BaseCommand):
+    help = "Generate responsive WebP/JPEG derivatives, dimensions and placeholders for uploaded images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--force', action='store_true', help="Regenerate existing derivatives too")
+        parser.add_argument(
+            '--placeholders-only', action='store_true',
+            help="Only compute dimensions and placeholders, leaving derivatives alone",
+        )
+
+    def handle(self, *args, workers, force, placeholders_only, **options):
+        derivatives = not placeholders_only
+        fields = [field for field in IMAGE_FIELDS if derivatives or field != 'image_derivatives']
+        models = [model for model in apps.get_models() if issubclass(model, ImageDerivativesMixin)]
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+
+        total = 0
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            for model in models:
+                rows = model.objects.exclude(image='').exclude(image__isnull=True)
+                if not force:
+                    missing = Q(image_placeholder='')
+                    if derivatives:
+                        missing |= Q(image_derivatives={})
+                    rows = rows.filter(missing)
+                futures = {
+                    pool.submit(process_image, name, derivatives): pk
+                    for pk, name in rows.values_list('pk', 'image')
+                }
+                updated = []
+                for future in as_completed(futures):
+                    values = future.result()
+                    if values:
+                        updated.append(model(pk=futures[future], **values))
+                model.objects.bulk_update(updated, fields, batch_size=500)
+                total += len(updated)
+                self.stdout.write(f"{model._meta.label}: {len(updated)} images")
+
+        if total:
+            # bulk_update sends no signals: refresh the cards and every cached page
+            rebuild_product_cards()
+            bump_version(CATALOG_VERSION)
+            bump_version(CATALOG_STRUCTURE_VERSION)
+        self.stdout.write(self.style.SUCCESS(f"Processed {total} images"))
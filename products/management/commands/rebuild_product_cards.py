@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.cards import rebuild_product_cards
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized ProductCard rows used by listing pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, batch_size, **options):
+        total = rebuild_product_cards(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} product cards"))
@@ -0,0 +1,20 @@
+# Generated by Django 5.0.14 on 2026-10-18 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0002_alter_category_image_alter_productimage_image"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["is_active", "base_price"],
+                name="products_pr_is_acti_8ef722_idx",
+            ),
+        ),
+    ]
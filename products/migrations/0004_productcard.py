@@ -0,0 +1,79 @@
+# Generated by Django 5.0.14 on 2026-10-18 16:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0003_product_price_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductCard",
+            fields=[
+                (
+                    "product",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="card",
+                        serialize=False,
+                        to="products.product",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255)),
+                ("slug", models.SlugField(db_index=False, max_length=255)),
+                ("category_name", models.CharField(max_length=200)),
+                ("category_slug", models.SlugField(db_index=False, max_length=200)),
+                ("image_url", models.CharField(blank=True, max_length=500)),
+                ("image_alt", models.CharField(blank=True, max_length=255)),
+                ("base_price", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("min_price", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("max_price", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("in_stock", models.BooleanField(default=False)),
+                ("sizes", models.JSONField(blank=True, default=list)),
+                ("colors", models.JSONField(blank=True, default=list)),
+                ("is_active", models.BooleanField(default=True)),
+                ("is_featured", models.BooleanField(default=False)),
+                ("is_new_arrival", models.BooleanField(default=False)),
+                (
+                    "created_at",
+                    models.DateTimeField(help_text="Copied from the product"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(
+                        auto_now=True, help_text="When this card was last rebuilt"
+                    ),
+                ),
+                (
+                    "category",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="products.category",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["is_active", "-created_at"],
+                        name="products_pr_is_acti_2623f5_idx",
+                    ),
+                    models.Index(
+                        fields=["is_active", "base_price"],
+                        name="products_pr_is_acti_cdfeb0_idx",
+                    ),
+                    models.Index(
+                        fields=["category", "is_active", "-created_at"],
+                        name="products_pr_categor_3efaea_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
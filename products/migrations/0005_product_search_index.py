@@ -0,0 +1,59 @@
+# Generated by Django 5.0.14 on 2026-10-18 16:15
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The search index is vendor specific (see products.search), so it is created
+# here with raw SQL instead of through Meta.indexes.
+
+POSTGRES_FORWARD = [
+    "CREATE INDEX products_product_search_vector_gin "
+    "ON products_product USING gin (search_vector)",
+    "UPDATE products_product AS p SET search_vector = "
+    "setweight(to_tsvector('english', coalesce(p.name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(c.name, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(p.description, '')), 'C') "
+    "FROM products_category AS c WHERE c.id = p.category_id",
+]
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS products_product_search_vector_gin",
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE products_product_fts "
+    "USING fts5(name, category_name, description, tokenize='porter unicode61')",
+    "INSERT INTO products_product_fts (rowid, name, category_name, description) "
+    "SELECT p.id, p.name, c.name, p.description "
+    "FROM products_product AS p JOIN products_category AS c ON c.id = p.category_id",
+]
+SQLITE_BACKWARD = [
+    "DROP TABLE IF EXISTS products_product_fts",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0004_productcard"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(
+            _run({"postgresql": POSTGRES_FORWARD, "sqlite": SQLITE_FORWARD}),
+            _run({"postgresql": POSTGRES_BACKWARD, "sqlite": SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.14 on 2026-10-18 16:45
+
+import core.storage
+import products.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0008_image_placeholder"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="category",
+            name="image",
+            field=models.ImageField(
+                blank=True,
+                null=True,
+                storage=core.storage.get_content_addressed_storage,
+                upload_to="categories/",
+                validators=[products.models.validate_image_size],
+            ),
+        ),
+        migrations.AlterField(
+            model_name="productimage",
+            name="image",
+            field=models.ImageField(
+                storage=core.storage.get_content_addressed_storage,
+                upload_to="products/",
+                validators=[products.models.validate_image_size],
+            ),
+        ),
+    ]
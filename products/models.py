@@ -1,7 +1,16 @@
+from django.contrib.postgres.search import SearchVectorField
+from django.core.cache import cache
 from django.db import models
+from django.db.models import Exists, F, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.urls import reverse
 from django.utils.text import slugify
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
+from core.images import ImageDerivativesMixin
+from core.storage import get_content_addressed_storage
+from .versioning import get_version, product_variants_version
 
 def validate_image_size(image):
     file_size = image.size
@@ -10,11 +19,18 @@ def validate_image_size(image):
         raise ValidationError(f"Max size of file is {limit_mb} MB")
 
 
-class Category(models.Model):
+class Category(ImageDerivativesMixin, models.Model):
     """Product category model"""
     name = models.CharField(max_length=200, unique=True)
     slug = models.SlugField(max_length=200, unique=True, blank=True)
-    image = models.ImageField(upload_to='categories/', blank=True, null=True, validators=[validate_image_size])
+    image = models.ImageField(
+        upload_to='categories/', blank=True, null=True, validators=[validate_image_size],
+        storage=get_content_addressed_storage,
+    )
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_placeholder = models.TextField(blank=True, editable=False)
     description = models.TextField(blank=True)
     is_active = models.BooleanField(default=True)
     order = models.PositiveIntegerField(default=0, db_index=True)
@@ -33,11 +49,52 @@ class Category(models.Model):
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
 
+    def get_absolute_url(self):
+        return reverse('products:category', args=[self.slug])
+
     @property
     def product_count(self):
         return self.products.filter(is_active=True).count()
 
 
+class VariantMatrix:
+    """Size x color stock levels of a product's available variants"""
+
+    def __init__(self, rows):
+        size_order = {code: i for i, (code, _) in enumerate(ProductVariant.SIZE_CHOICES)}
+
+        def size_rank(size):
+            return (size_order.get(size, len(size_order)), size)
+
+        # (size, color) -> (variant id, stock quantity)
+        self.cells = {(size, color): (pk, stock) for pk, size, color, stock in rows}
+        in_stock = [key for key, (_, stock) in self.cells.items() if stock > 0]
+        self.sizes = sorted({size for size, _ in in_stock}, key=size_rank)
+        self.colors = sorted({color for _, color in in_stock})
+        self.valid_combinations = [
+            {'color': color, 'size': size}
+            for size, color in sorted(in_stock, key=lambda key: (size_rank(key[0]), key[1]))
+        ]
+
+    @property
+    def in_stock(self):
+        return bool(self.valid_combinations)
+
+    def stock(self, size, color):
+        return self.cells.get((size, color), (None, 0))[1]
+
+
+class ProductQuerySet(models.QuerySet):
+    def for_cards(self):
+        """Load everything a product card renders in a constant number of queries"""
+        return self.select_related('category').annotate(
+            has_stock=Exists(ProductVariant.objects.in_stock().filter(product=OuterRef('pk')))
+        ).prefetch_related(
+            # Meta ordering puts the primary image first, so one row per product is enough
+            Prefetch('images', queryset=ProductImage.objects.all()[:1], to_attr='card_images')
+        )
+
+
 class Product(models.Model):
     """Product model"""
     name = models.CharField(max_length=255)
@@ -50,12 +107,17 @@ class Product(models.Model):
     is_new_arrival = models.BooleanField(default=False, help_text="Show in New Arrivals section")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Maintained by products.search.PostgresSearchBackend, unused elsewhere
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['slug']),
             models.Index(fields=['is_active', '-created_at']),
+            models.Index(fields=['is_active', 'base_price']),
         ]
 
     def __str__(self):
@@ -69,6 +131,12 @@ class Product(models.Model):
     @property
     def primary_image(self):
         """Get the primary product image"""
+        if hasattr(self, 'card_images'):
+            return self.card_images[0] if self.card_images else None
+        if 'images' in getattr(self, '_prefetched_objects_cache', {}):
+            # Meta ordering puts the primary image first
+            images = self.images.all()
+            return images[0] if images else None
         primary = self.images.filter(is_primary=True).first()
         if primary:
             return primary
@@ -82,23 +150,42 @@ class Product(models.Model):
     @property
     def in_stock(self):
         """Check if any variant has stock"""
-        return self.variants.filter(is_available=True, stock_quantity__gt=0).exists()
+        if hasattr(self, 'has_stock'):
+            return self.has_stock
+        return self.variants.in_stock().exists()
+
+    def variant_matrix(self):
+        """Availability matrix of the variants, cached per variant version"""
+        version = get_version(product_variants_version(self.pk))
+        key = f'variant-matrix:{self.pk}:{version}'
+        matrix = cache.get(key)
+        if matrix is None:
+            rows = self.variants.filter(is_available=True).with_available().values_list(
+                'pk', 'size', 'color', 'available_quantity'
+            )
+            matrix = VariantMatrix(rows)
+            cache.set(key, matrix, 60 * 60 * 24)
+        return matrix
 
     @property
     def available_sizes(self):
         """Get list of available sizes"""
-        return self.variants.filter(is_available=True, stock_quantity__gt=0).values_list('size', flat=True).distinct()
+        return self.variants.in_stock().values_list('size', flat=True).distinct()
 
     @property
     def available_colors(self):
         """Get list of available colors"""
-        return self.variants.filter(is_available=True, stock_quantity__gt=0).values_list('color', flat=True).distinct()
+        return self.variants.in_stock().values_list('color', flat=True).distinct()
 
 
-class ProductImage(models.Model):
+class ProductImage(ImageDerivativesMixin, models.Model):
     """Product image model - supports multiple images per product"""
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='products/', validators=[validate_image_size])
+    image = models.ImageField(upload_to='products/', validators=[validate_image_size], storage=get_content_addressed_storage)
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_placeholder = models.TextField(blank=True, editable=False)
     alt_text = models.CharField(max_length=255, blank=True)
     is_primary = models.BooleanField(default=False, help_text="Main image for product card")
     order = models.PositiveIntegerField(default=0)
@@ -120,6 +207,24 @@ class ProductImage(models.Model):
         super().save(*args, **kwargs)
 
 
+def reserved_quantity(variant_ref='pk', exclude_cart_id=None, now=None):
+    """Subquery summing the reservations of a variant active at ``now``"""
+    reservations = StockReservation.objects.active(now).filter(variant=OuterRef(variant_ref))
+    if exclude_cart_id:
+        reservations = reservations.exclude(cart_id=exclude_cart_id)
+    total = reservations.values('variant').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(total), 0)
+
+
+class ProductVariantQuerySet(models.QuerySet):
+    def with_available(self):
+        """Annotate ``available_quantity``: stock not held by active reservations"""
+        return self.annotate(available_quantity=F('stock_quantity') - reserved_quantity())
+
+    def in_stock(self):
+        return self.with_available().filter(is_available=True, available_quantity__gt=0)
+
+
 class ProductVariant(models.Model):
     """Product variant model for size/color combinations"""
     SIZE_CHOICES = [
@@ -140,6 +245,8 @@ class ProductVariant(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductVariantQuerySet.as_manager()
+
     class Meta:
         unique_together = ['product', 'size', 'color']
         ordering = ['size', 'color']
@@ -157,6 +264,93 @@ class ProductVariant(models.Model):
             self.sku = f"{base_sku}-{self.size}-{slugify(self.color)}"
         super().save(*args, **kwargs)
 
+    @property
+    def available(self):
+        """Stock not held by other customers' reservations"""
+        if hasattr(self, 'available_quantity'):
+            return self.available_quantity
+        reserved = self.reservations.active().aggregate(total=Sum('quantity'))['total'] or 0
+        return self.stock_quantity - reserved
+
     @property
     def in_stock(self):
-        return self.is_available and self.stock_quantity > 0
+        return self.is_available and self.available > 0
+
+
+class StockReservationQuerySet(models.QuerySet):
+    def active(self, now=None):
+        return self.filter(expires_at__gt=now or timezone.now())
+
+    def expired(self):
+        return self.filter(expires_at__lte=timezone.now())
+
+
+class StockReservation(models.Model):
+    """Stock held for a cart between opening checkout and placing the order"""
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='reservations')
+    cart_id = models.CharField(max_length=64)
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = StockReservationQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['variant', 'cart_id'], name='unique_reservation_per_cart'),
+        ]
+        indexes = [
+            # Active reservations of a variant: the availability aggregate
+            models.Index(fields=['variant', 'expires_at']),
+            models.Index(fields=['expires_at']),
+            models.Index(fields=['cart_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.variant} x {self.quantity} for {self.cart_id}"
+
+
+class ProductCard(models.Model):
+    """Denormalized read model holding everything a product listing renders.
+
+    Rows are rebuilt from Product, ProductImage, ProductVariant and Category
+    whenever those change (see products.signals), so listing pages read a
+    single indexed table instead of joining four.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='card')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    name = models.CharField(max_length=255)
+    slug = models.SlugField(max_length=255, db_index=False)
+    category_name = models.CharField(max_length=200)
+    category_slug = models.SlugField(max_length=200, db_index=False)
+    image_url = models.CharField(max_length=500, blank=True)
+    image_derivatives = models.JSONField(default=dict, blank=True)
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_placeholder = models.TextField(blank=True)
+    image_alt = models.CharField(max_length=255, blank=True)
+    base_price = models.DecimalField(max_digits=10, decimal_places=2)
+    min_price = models.DecimalField(max_digits=10, decimal_places=2)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2)
+    in_stock = models.BooleanField(default=False)
+    sizes = models.JSONField(default=list, blank=True)
+    colors = models.JSONField(default=list, blank=True)
+    is_active = models.BooleanField(default=True)
+    is_featured = models.BooleanField(default=False)
+    is_new_arrival = models.BooleanField(default=False)
+    created_at = models.DateTimeField(help_text="Copied from the product")
+    updated_at = models.DateTimeField(auto_now=True, help_text="When this card was last rebuilt")
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_active', '-created_at']),
+            models.Index(fields=['is_active', 'base_price']),
+            models.Index(fields=['category', 'is_active', '-created_at']),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    def get_absolute_url(self):
+        return reverse('products:detail', args=[self.slug])
@@ -0,0 +1,176 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+# Each sort mode ends with the primary key so the ordering is total and a
+# cursor always points at exactly one row.
+SORT_ORDERINGS = {
+    'price_asc': ('base_price', 'pk'),
+    'price_desc': ('-base_price', '-pk'),
+    'newest': ('-created_at', '-pk'),
+}
+DEFAULT_ORDERING = ('-created_at', '-pk')
+# Used for search results, where the backend annotates a relevance ``rank``
+RANK_ORDERING = ('-rank', '-pk')
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor cannot be decoded for the given ordering"""
+
+
+class KeysetPage:
+    """A single page of keyset-paginated results"""
+
+    def __init__(self, object_list, next_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def get_ordering(sort):
+    """Return the keyset ordering for a shop sort mode"""
+    return SORT_ORDERINGS.get(sort, DEFAULT_ORDERING)
+
+
+def _get_field(model, field_name):
+    """Return the model field behind an ordering entry, or None for annotations"""
+    name = field_name.lstrip('-')
+    if name == 'pk':
+        return model._meta.pk
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+
+def encode_cursor(obj, ordering):
+    """Encode the ordering values of ``obj`` into an opaque URL-safe token"""
+    values = []
+    for field_name in ordering:
+        field = _get_field(type(obj), field_name)
+        if field is None:
+            values.append(getattr(obj, field_name.lstrip('-')))
+        else:
+            values.append(field.value_to_string(obj))
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, ordering):
+    """Decode a cursor token back into typed values for ``ordering``"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor(cursor)
+
+    decoded = []
+    for field_name, value in zip(ordering, values):
+        field = _get_field(model, field_name)
+        if field is None:
+            # Annotations such as a search rank are plain numbers; they must
+            # be doubles, which JSON floats round-trip exactly
+            if not isinstance(value, (int, float)):
+                raise InvalidCursor(cursor)
+            decoded.append(value)
+            continue
+        try:
+            decoded.append(field.to_python(value))
+        except ValidationError:
+            raise InvalidCursor(cursor)
+    return decoded
+
+
+def _after(ordering, values):
+    """Build the condition for rows after ``values`` in ``ordering``.
+
+    This is the row-value comparison ``(a, b, ...) > (va, vb, ...)``
+    expanded into ``a > va OR (a = va AND b > vb) OR ...``, since each column
+    has its own direction and mixed orderings cannot be written as a single
+    row comparison. The leading ``a > va`` / ``a = va`` terms still let the
+    database start from a matching index instead of scanning earlier rows.
+    """
+    condition = Q()
+    for i, field_name in enumerate(ordering):
+        name = field_name.lstrip('-')
+        lookup = 'lt' if field_name.startswith('-') else 'gt'
+        clause = Q(**{f'{name}__{lookup}': values[i]})
+        for prev_name, prev_value in zip(ordering[:i], values[:i]):
+            clause &= Q(**{prev_name.lstrip('-'): prev_value})
+        condition |= clause
+    return condition
+
+
+def _sort_in_memory(keys, ordering):
+    """Primary keys of ``keys`` (pk -> ``{field: value}``) sorted by ``ordering``"""
+    pks = list(keys)
+    # Stable sorts from the last column to the first honour mixed directions
+    for field_name in reversed(ordering):
+        name = field_name.lstrip('-')
+        pks.sort(key=lambda pk: keys[pk][name], reverse=field_name.startswith('-'))
+    return pks
+
+
+def _is_after(row, ordering, values):
+    for field_name, value in zip(ordering, values):
+        name = field_name.lstrip('-')
+        if row[name] != value:
+            return row[name] < value if field_name.startswith('-') else row[name] > value
+    return False
+
+
+def paginate_keys(queryset, ordering, keys, cursor=None, per_page=24):
+    """Like ``paginate`` for rows whose ordering values are already in memory.
+
+    ``keys`` maps the primary key of every row in the listing to its values
+    for ``ordering`` (e.g. from the facet index), so the page is found in
+    Python and only its ``per_page`` rows are fetched, by primary key,
+    however many rows match.
+    """
+    pks = _sort_in_memory(keys, ordering)
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, ordering)
+        start = next((i for i, pk in enumerate(pks) if _is_after(keys[pk], ordering, values)), len(pks))
+        pks = pks[start:]
+    pks = pks[:per_page + 1]
+    rows = queryset.filter(pk__in=pks).in_bulk()
+    rows = [rows[pk] for pk in pks if pk in rows]
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1], ordering)
+    return KeysetPage(rows, next_cursor)
+
+
+def paginate(queryset, ordering, cursor=None, per_page=24):
+    """Return the page of ``queryset`` that follows ``cursor``
+
+    Unlike OFFSET pagination, the cost of a page does not depend on how deep
+    into the listing it is: the cursor becomes an indexed range condition.
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, ordering)
+        queryset = queryset.filter(_after(ordering, values))
+
+    rows = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1], ordering)
+    return KeysetPage(rows, next_cursor)
@@ -0,0 +1,148 @@
+"""Pluggable product search backends.
+
+Backends filter a ``ProductCard`` queryset down to the cards matching a
+query and annotate each with a relevance ``rank`` (higher is better), as a
+double so it survives the round trip through a pagination cursor. They
+also keep their index current through ``index_products`` /
+``remove_products``, which products.signals calls on every write.
+
+The backend is chosen with ``settings.PRODUCT_SEARCH_BACKEND`` (a dotted
+path); by default it follows the database vendor.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, FloatField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Category
+
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'products_product_fts'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SimpleSearchBackend:
+    """Substring matching for databases without a full-text engine"""
+
+    def search(self, queryset, query):
+        return queryset.filter(
+            Q(name__icontains=query) |
+            Q(product__description__icontains=query) |
+            Q(category_name__icontains=query)
+        ).annotate(rank=Value(0.0, output_field=FloatField()))
+
+    def index_products(self, products):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+
+class PostgresSearchBackend:
+    """Ranked search over the stored, GIN-indexed ``Product.search_vector``"""
+
+    def search(self, queryset, query):
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        # ts_rank returns a float4, which a cursor's JSON float (a double)
+        # never equals exactly; as a double the boundary row compares equal
+        return queryset.filter(product__search_vector=search_query).annotate(
+            rank=Cast(SearchRank(F('product__search_vector'), search_query), FloatField())
+        )
+
+    def index_products(self, products):
+        category_name = Subquery(
+            Category.objects.filter(pk=OuterRef('category_id')).values('name')[:1]
+        )
+        products.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG) +
+            SearchVector(category_name, weight='B', config=SEARCH_CONFIG) +
+            SearchVector('description', weight='C', config=SEARCH_CONFIG)
+        ))
+
+    def remove_products(self, product_ids):
+        # The vector lives on the product row and goes away with it
+        pass
+
+
+class SQLiteFTSBackend:
+    """Ranked search over an FTS5 table keyed by product id (local/bench use)"""
+
+    # bm25 column weights for (name, category_name, description)
+    weights = (10.0, 5.0, 1.0)
+
+    def _match_expression(self, query):
+        # Quote every token so user input can never be parsed as FTS syntax,
+        # and allow prefix matches for search-as-you-type.
+        tokens = _TOKEN_RE.findall(query)
+        return ' '.join('"%s"*' % token for token in tokens)
+
+    def search(self, queryset, query):
+        match = self._match_expression(query)
+        if not match:
+            return queryset.none()
+        pk_column = '%s.%s' % (
+            connection.ops.quote_name(queryset.model._meta.db_table),
+            connection.ops.quote_name(queryset.model._meta.pk.column),
+        )
+        weights = ', '.join(str(w) for w in self.weights)
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        ).annotate(rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = {pk_column}',
+            [match],
+            output_field=FloatField(),
+        ))
+
+    def index_products(self, products):
+        rows = list(products.values_list('pk', 'name', 'category__name', 'description'))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows]
+            )
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, category_name, description) '
+                'VALUES (%s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in product_ids]
+            )
+
+
+VENDOR_BACKENDS = {
+    'postgresql': 'products.search.PostgresSearchBackend',
+    'sqlite': 'products.search.SQLiteFTSBackend',
+}
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    if path is None:
+        path = VENDOR_BACKENDS.get(connection.vendor, 'products.search.SimpleSearchBackend')
+    return import_string(path)()
+
+
+def search_products(queryset, query):
+    """Filter a ProductCard queryset to ``query`` matches annotated with ``rank``"""
+    return get_search_backend().search(queryset, query)
+
+
+def reindex_products(products):
+    """(Re)index the products in the given Product queryset"""
+    get_search_backend().index_products(products)
+
+
+def unindex_products(product_ids):
+    get_search_backend().remove_products(product_ids)
@@ -0,0 +1,172 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.images import image_processed
+from core.page_cache import purge_tags
+
+from .cards import refresh_product_cards
+from .models import Category, Product, ProductCard, ProductImage, ProductVariant
+from .search import reindex_products, unindex_products
+from .sitemaps import categories_changed, products_changed
+from .versioning import (
+    CATALOG_DELETES_VERSION, CATALOG_STRUCTURE_VERSION, CATALOG_VERSION, bump_version,
+    product_variants_version,
+)
+
+
+def schedule_card_refresh(product_id):
+    """Rebuild a product card once the current transaction commits.
+
+    Deferring matters for cascaded deletes: image/variant deletions fire
+    before their product row is gone, and the rebuild must not resurrect it.
+    """
+    def refresh():
+        refresh_product_cards([product_id])
+        bump_version(CATALOG_VERSION)
+    transaction.on_commit(refresh)
+
+
+def purge_product_pages(product_id, category_ids):
+    """Drop the cached pages showing a product once the change is visible"""
+    tags = [f'product:{product_id}', 'shop', 'home']
+    tags += [f'category:{pk}' for pk in category_ids if pk is not None]
+
+    def purge():
+        purge_tags(*tags)
+        products_changed([product_id])
+    transaction.on_commit(purge)
+
+
+def catalog_changed(deleted=False, structure=False):
+    """Invalidate per-process catalog caches once the change is visible"""
+    def bump():
+        bump_version(CATALOG_VERSION)
+        if deleted:
+            bump_version(CATALOG_DELETES_VERSION)
+        if structure:
+            bump_version(CATALOG_STRUCTURE_VERSION)
+    transaction.on_commit(bump)
+
+
+def products_updated(product_ids, variants=False):
+    """Refresh everything derived from products changed by queryset.update(),
+    which sends no signals. Pass ``variants=True`` when their variants
+    (e.g. stock levels) were updated that way."""
+    rows = list(Product.objects.filter(pk__in=list(product_ids)).values_list('pk', 'category_id'))
+    refresh_product_cards([pk for pk, _ in rows])
+    tags = ['shop', 'home']
+    tags += [f'product:{pk}' for pk, _ in rows]
+    tags += [f'category:{pk}' for pk in {category_id for _, category_id in rows}]
+
+    def bump():
+        bump_version(CATALOG_VERSION)
+        if variants:
+            for pk, _ in rows:
+                bump_version(product_variants_version(pk))
+        purge_tags(*tags)
+        products_changed([pk for pk, _ in rows])
+    transaction.on_commit(bump)
+
+
+def variants_changed(product_ids):
+    """Refresh the variant matrices of products whose stock levels changed
+    without any variant going in or out of stock; use ``products_updated``
+    when availability changed, which also refreshes cards and pages"""
+    product_ids = list(product_ids)
+
+    def bump():
+        for pk in product_ids:
+            bump_version(product_variants_version(pk))
+    transaction.on_commit(bump)
+
+
+def stock_changed(variant_products, in_stock_before, in_stock_after):
+    """Refresh what depends on the stock of ``{variant_id: product_id}``,
+    given the ids of those variants in stock before and after the change"""
+    flipped = in_stock_before ^ in_stock_after
+    affected = {variant_products[pk] for pk in flipped}
+    if affected:
+        products_updated(affected, variants=True)
+    others = set(variant_products.values()) - affected
+    if others:
+        variants_changed(others)
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, **kwargs):
+    # Moving a product to another category changes the old category's pages too
+    instance._previous_category_id = None
+    if instance.pk is not None:
+        instance._previous_category_id = (
+            Product.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    schedule_card_refresh(instance.pk)
+    reindex_products(Product.objects.filter(pk=instance.pk))
+    purge_product_pages(instance.pk, {instance.category_id, instance._previous_category_id})
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    unindex_products([instance.pk])
+    catalog_changed(deleted=True)
+    purge_product_pages(instance.pk, [instance.category_id])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(image_processed, sender=ProductImage)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def product_child_changed(sender, instance, **kwargs):
+    schedule_card_refresh(instance.product_id)
+    category_id = (
+        Product.objects.filter(pk=instance.product_id).values_list('category_id', flat=True).first()
+    )
+    purge_product_pages(instance.product_id, [category_id])
+    if sender is ProductVariant:
+        product_id = instance.product_id
+        transaction.on_commit(lambda: bump_version(product_variants_version(product_id)))
+
+
+@receiver(pre_save, sender=Category)
+def category_saving(sender, instance, **kwargs):
+    instance._previous_card_fields = None
+    if instance.pk is not None:
+        instance._previous_card_fields = (
+            Category.objects.filter(pk=instance.pk).values_list('name', 'slug').first()
+        )
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, **kwargs):
+    # The structure version also invalidates every cached page (see core.page_cache)
+    catalog_changed(structure=True)
+    transaction.on_commit(categories_changed)
+    # Reorders and other saves leave the products alone, so their cards
+    # and search index only change with the name or slug (the product
+    # sitemaps show neither)
+    if instance._previous_card_fields in (None, (instance.name, instance.slug)):
+        return
+    ProductCard.objects.filter(category=instance).update(
+        category_name=instance.name,
+        category_slug=instance.slug,
+        updated_at=timezone.now(),
+    )
+    reindex_products(Product.objects.filter(category=instance))
+
+
+@receiver(image_processed, sender=Category)
+def category_image_processed(sender, instance, **kwargs):
+    catalog_changed(structure=True)
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    catalog_changed(deleted=True, structure=True)
+    transaction.on_commit(categories_changed)
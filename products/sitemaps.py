@@ -1,20 +1,75 @@
-from django.contrib.sitemaps import Sitemap
+"""Sitemap entries for the catalog, see core.sitemap_files.
+
+Products are split into sitemaps by primary key range, so a product always
+lands in the same sitemap and a change only rewrites that one.
+"""
+from django.db.models import F
 from django.urls import reverse
-from .models import Product, Category
 
-class ProductSitemap(Sitemap):
-    changefreq = "weekly"
-    priority = 0.9
+from .models import Category, ProductCard
+from .versioning import bump_version
+
+PRODUCTS_PER_SITEMAP = 50000
+ROW_BATCH = 2000
+
+
+def product_chunk(product_id):
+    return product_id // PRODUCTS_PER_SITEMAP
+
+
+def product_sections():
+    """Names of the product sitemaps that have active products"""
+    chunks = (
+        ProductCard.objects.filter(is_active=True)
+        .annotate(chunk=F('pk') / PRODUCTS_PER_SITEMAP)
+        .values_list('chunk', flat=True).distinct().order_by('chunk')
+    )
+    return [f'products-{chunk}' for chunk in chunks]
+
+
+def _url_pattern(name):
+    # Reverse once and fill in slugs, rather than reversing every row
+    return reverse(name, args=['__slug__']).replace('__slug__', '{}')
+
+
+def product_entries(chunk):
+    """``(path, lastmod)`` of the active products in sitemap ``chunk``.
+
+    The lastmod is when the product itself was last edited: cards are
+    rebuilt for stock changes too, which would make every sale look like
+    a content change to crawlers.
+    """
+    pattern = _url_pattern('products:detail')
+    first = chunk * PRODUCTS_PER_SITEMAP
+    rows = (
+        ProductCard.objects.filter(is_active=True, pk__gte=first, pk__lt=first + PRODUCTS_PER_SITEMAP)
+        .order_by('pk').values_list('slug', 'product__updated_at')
+    )
+    for slug, updated_at in rows.iterator(chunk_size=ROW_BATCH):
+        yield pattern.format(slug), updated_at
+
+
+def category_entries():
+    pattern = _url_pattern('products:category')
+    rows = Category.objects.filter(is_active=True).order_by('order', 'pk').values_list('slug', 'updated_at')
+    for slug, updated_at in rows.iterator(chunk_size=ROW_BATCH):
+        yield pattern.format(slug), updated_at
+
+
+def sitemap_version(section):
+    return f'sitemap:{section}'
+
+
+SITEMAP_INDEX_VERSION = sitemap_version('index')
 
-    def items(self):
-        return Product.objects.filter(is_active=True)
 
-    def lastmod(self, obj):
-        return obj.created_at
+def products_changed(product_ids):
+    """Mark the sitemaps of ``product_ids`` stale; call once the change is visible"""
+    for chunk in {product_chunk(pk) for pk in product_ids}:
+        bump_version(sitemap_version(f'products-{chunk}'))
+    bump_version(SITEMAP_INDEX_VERSION)
 
-class CategorySitemap(Sitemap):
-    changefreq = "weekly"
-    priority = 0.8
 
-    def items(self):
-        return Category.objects.filter(is_active=True)
+def categories_changed():
+    bump_version(sitemap_version('categories'))
+    bump_version(SITEMAP_INDEX_VERSION)
@@ -0,0 +1,59 @@
+from django import template
+
+from products.fragment_cache import render_fragment
+
+register = template.Library()
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, name, vary_on, versions):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+        self.versions = versions
+
+    def render(self, context):
+        return render_fragment(
+            self.name.resolve(context),
+            lambda: self.nodelist.render(context),
+            vary_on=[value.resolve(context) for value in self.vary_on],
+            versions=[version.resolve(context) for version in self.versions],
+        )
+
+
+@register.tag('cachefragment')
+def do_cachefragment(parser, token):
+    """
+    Cache the enclosed fragment until one of its key values changes.
+
+    Usage::
+
+        {% cachefragment "product_card" product.pk product.updated_at %}
+            ...
+        {% endcachefragment %}
+
+        {% cachefragment "category_nav" version "catalog-structure" %}
+            ...
+        {% endcachefragment %}
+
+    Positional arguments after the name are values the fragment varies on;
+    ``version "<name>"`` folds in a counter from products.versioning.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires at least a fragment name.")
+    nodelist = parser.parse(('endcachefragment',))
+    parser.delete_first_token()
+
+    name = parser.compile_filter(bits[1])
+    vary_on, versions = [], []
+    args = iter(bits[2:])
+    for arg in args:
+        if arg == 'version':
+            try:
+                versions.append(parser.compile_filter(next(args)))
+            except StopIteration:
+                raise template.TemplateSyntaxError(f"'{bits[0]}' tag: 'version' needs a counter name.")
+        else:
+            vary_on.append(parser.compile_filter(arg))
+    return FragmentCacheNode(nodelist, name, vary_on, versions)
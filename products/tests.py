@@ -1,3 +1,397 @@
-from django.test import TestCase
+from django.contrib.admin import helpers
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .models import Category, Product, ProductCard, ProductImage, ProductVariant
+from .cards import rebuild_product_cards
+from .autocomplete import suggestion_index
+from .facets import facet_index
+from .category_tree import category_tree
+from .fragment_cache import fragment_stats
+from . import views
 
-# Create your tests here.
+
+class ShopPaginationTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.category = Category.objects.create(name='Test Category', slug='test-cat')
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(7):
+                Product.objects.create(
+                    name=f'Product {i}',
+                    slug=f'product-{i}',
+                    category=self.category,
+                    description='Test',
+                    base_price=10 * (i % 3),
+                )
+        self.original_per_page = views.PRODUCTS_PER_PAGE
+        views.PRODUCTS_PER_PAGE = 3
+
+    def tearDown(self):
+        views.PRODUCTS_PER_PAGE = self.original_per_page
+
+    def collect_pages(self, sort=None):
+        params = {'sort': sort} if sort else {}
+        response = self.client.get(reverse('products:shop'), params)
+        names = [p.name for p in response.context['products']]
+        while response.context['next_page_url']:
+            response = self.client.get(response.context['next_page_url'], HTTP_HX_REQUEST='true')
+            self.assertTemplateUsed(response, 'components/product_grid_page.html')
+            self.assertTemplateNotUsed(response, 'pages/shop.html')
+            names += [p.name for p in response.context['products']]
+        return names
+
+    def test_pages_cover_every_product_once(self):
+        for sort in (None, 'newest', 'price_asc', 'price_desc'):
+            names = self.collect_pages(sort)
+            self.assertEqual(len(names), 7)
+            self.assertEqual(len(set(names)), 7)
+
+    def test_price_sort_order_is_kept_across_pages(self):
+        names = self.collect_pages('price_asc')
+        prices = [Product.objects.get(name=n).base_price for n in names]
+        self.assertEqual(prices, sorted(prices))
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get(reverse('products:shop'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductCardQueryTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Test Category', slug='test-cat')
+        for i in range(5):
+            product = Product.objects.create(
+                name=f'Product {i}',
+                slug=f'product-{i}',
+                category=self.category,
+                description='Test',
+                base_price=10,
+            )
+            ProductImage.objects.create(product=product, image=f'products/{i}-b.jpg', order=1)
+            ProductImage.objects.create(product=product, image=f'products/{i}-a.jpg', is_primary=(i % 2 == 0), order=2)
+            ProductVariant.objects.create(product=product, size='M', color='Blue', stock_quantity=i % 2)
+
+    def test_for_cards_matches_uncached_properties(self):
+        for product in Product.objects.for_cards():
+            fresh = Product.objects.get(pk=product.pk)
+            self.assertEqual(product.primary_image, fresh.primary_image)
+            self.assertEqual(product.in_stock, fresh.in_stock)
+
+    def test_card_attributes_need_no_extra_queries(self):
+        products = list(Product.objects.for_cards())
+        with self.assertNumQueries(0):
+            for product in products:
+                product.primary_image
+                product.in_stock
+                product.category.name
+
+
+class ProductCardTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Test Category', slug='test-cat')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(
+                name='Test Product',
+                slug='test-product',
+                category=self.category,
+                description='Test',
+                base_price=100,
+            )
+
+    def test_card_follows_variant_and_image_writes(self):
+        card = ProductCard.objects.get(product=self.product)
+        self.assertFalse(card.in_stock)
+        self.assertEqual(card.image_url, '')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            variant = ProductVariant.objects.create(product=self.product, size='M', color='Blue', stock_quantity=3)
+            ProductImage.objects.create(product=self.product, image='products/a.jpg', is_primary=True)
+        card.refresh_from_db()
+        self.assertTrue(card.in_stock)
+        self.assertEqual(card.sizes, ['M'])
+        self.assertEqual(card.colors, ['Blue'])
+        self.assertTrue(card.image_url.endswith('products/a.jpg'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            variant.delete()
+        card.refresh_from_db()
+        self.assertFalse(card.in_stock)
+
+    def test_category_rename_updates_cards(self):
+        self.category.name = 'Renamed'
+        self.category.save()
+        self.assertEqual(ProductCard.objects.get(product=self.product).category_name, 'Renamed')
+
+    def test_product_delete_removes_card(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.product, image='products/a.jpg')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertFalse(ProductCard.objects.exists())
+
+    def test_rebuild_restores_missing_cards(self):
+        ProductCard.objects.all().delete()
+        self.assertEqual(rebuild_product_cards(), 1)
+        self.assertEqual(ProductCard.objects.get().name, 'Test Product')
+
+    def test_admin_action_refreshes_rows_filtered_out_by_the_update(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin:products_product_changelist') + '?is_active__exact=1', {
+                'action': 'make_inactive',
+                helpers.ACTION_CHECKBOX_NAME: [self.product.pk],
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(ProductCard.objects.get(product=self.product).is_active)
+        self.assertNotContains(self.client.get(reverse('products:shop')), 'Test Product')
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.category = Category.objects.create(name='Knitwear', slug='knitwear')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sweater = Product.objects.create(
+                name='Wool Sweater', slug='wool-sweater', category=self.category,
+                description='Warm and soft', base_price=50,
+            )
+            self.scarf = Product.objects.create(
+                name='Scarf', slug='scarf', category=self.category,
+                description='Pairs well with any sweater', base_price=20,
+            )
+
+    def search(self, query):
+        response = self.client.get(reverse('products:search'), {'q': query})
+        return [p.name for p in response.context['products']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('sweater'), ['Wool Sweater', 'Scarf'])
+
+    def test_ranked_results_page_through_the_cursor(self):
+        per_page, views.PRODUCTS_PER_PAGE = views.PRODUCTS_PER_PAGE, 1
+        self.addCleanup(setattr, views, 'PRODUCTS_PER_PAGE', per_page)
+        response = self.client.get(reverse('products:search'), {'q': 'sweater'})
+        names = [p.name for p in response.context['products']]
+        while response.context['next_page_url']:
+            response = self.client.get(response.context['next_page_url'])
+            names += [p.name for p in response.context['products']]
+        self.assertEqual(names, ['Wool Sweater', 'Scarf'])
+
+    def test_index_follows_product_and_category_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scarf.name = 'Cashmere Scarf'
+            self.scarf.save()
+        self.assertEqual(self.search('cashmere'), ['Cashmere Scarf'])
+
+        self.category.name = 'Winter'
+        self.category.save()
+        self.assertEqual(len(self.search('winter')), 2)
+
+        self.scarf.delete()
+        self.assertEqual(self.search('cashmere'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('"sweater* ('), ['Wool Sweater', 'Scarf'])
+
+
+class SuggestionIndexTests(TestCase):
+    def setUp(self):
+        suggestion_index._reset()
+        self.category = Category.objects.create(name='Knitwear', slug='knitwear')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sweater = Product.objects.create(
+                name='Wool Sweater', slug='wool-sweater', category=self.category,
+                description='Warm', base_price=50,
+            )
+            Product.objects.create(
+                name='Denim Jacket', slug='denim-jacket',
+                category=Category.objects.create(name='Outerwear', slug='outerwear'),
+                description='Blue', base_price=80,
+            )
+
+    def names(self, query):
+        return [s.name for s in suggestion_index.suggest(query)]
+
+    def test_prefix_typo_and_category_matches(self):
+        self.assertEqual(self.names('wo'), ['Wool Sweater'])
+        self.assertEqual(self.names('sweter'), ['Wool Sweater'])
+        self.assertEqual(self.names('knit'), ['Wool Sweater'])
+        self.assertEqual(self.names('denim jack'), ['Denim Jacket'])
+
+    def test_suggestions_need_no_queries_until_catalog_changes(self):
+        self.names('wo')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('wool'), ['Wool Sweater'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sweater.name = 'Merino Sweater'
+            self.sweater.save()
+        self.assertEqual(self.names('wool'), [])
+        self.assertEqual(self.names('merino'), ['Merino Sweater'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sweater.delete()
+        self.assertEqual(self.names('merino'), [])
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.category = Category.objects.create(name='Tops', slug='tops')
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, (size, color, stock, price) in enumerate([
+                ('S', 'Red', 5, 20),
+                ('M', 'Red', 0, 40),
+                ('M', 'Blue', 3, 60),
+            ]):
+                product = Product.objects.create(
+                    name=f'Top {i}', slug=f'top-{i}', category=self.category,
+                    description='Test', base_price=price,
+                )
+                ProductVariant.objects.create(product=product, size=size, color=color, stock_quantity=stock)
+
+    def get(self, **params):
+        response = self.client.get(reverse('products:category', args=['tops']), params)
+        groups = {g['name']: {v['value']: v['count'] for v in g['values']} for g in response.context['facet_groups']}
+        return [p.name for p in response.context['products']], groups
+
+    def test_counts_follow_other_facets(self):
+        names, groups = self.get(color='Red')
+        self.assertEqual(names, ['Top 0'])
+        # Top 1 has no stocked variant, so it only counts towards price
+        self.assertEqual(groups['color'], {'Red': 1, 'Blue': 1})
+        self.assertEqual(groups['size'], {'S': 1})
+
+    def test_filtered_listing_pages_fetch_only_their_rows(self):
+        views_per_page, views.PRODUCTS_PER_PAGE = views.PRODUCTS_PER_PAGE, 1
+        self.addCleanup(setattr, views, 'PRODUCTS_PER_PAGE', views_per_page)
+        for sort, expected in (('price_desc', ['Top 2', 'Top 0']), ('price_asc', ['Top 0', 'Top 2'])):
+            url = reverse('products:category', args=['tops']) + f'?in_stock=1&sort={sort}'
+            names = []
+            while url:
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                names += [p.name for p in response.context['products']]
+                url = response.context['next_page_url']
+                # The page plus one row to detect the next page, whatever matched
+                listing = [q['sql'] for q in queries if 'products_productcard' in q['sql'] and ' IN (' in q['sql']]
+                self.assertEqual(len(listing), 1)
+                self.assertLessEqual(listing[0].split(' IN (')[1].split(')')[0].count(','), 1)
+            self.assertEqual(names, expected)
+
+    def test_filters_combine_across_facets(self):
+        names, _ = self.get(size='M', price='50-100', in_stock='1')
+        self.assertEqual(names, ['Top 2'])
+        names, _ = self.get(price=['0-25', '25-50'])
+        self.assertEqual(sorted(names), ['Top 0', 'Top 1'])
+
+    def test_facets_need_no_queries_once_built(self):
+        facet_index.select(None, {})
+        with self.assertNumQueries(0):
+            facet_index.select(self.category.id, {'size': {'M'}})
+
+
+class VariantMatrixTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        category = Category.objects.create(name='Tops', slug='tops')
+        self.product = Product.objects.create(
+            name='Tee', slug='tee', category=category, description='Test', base_price=10,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.variant = ProductVariant.objects.create(product=self.product, size='L', color='Red', stock_quantity=2)
+            ProductVariant.objects.create(product=self.product, size='S', color='Blue', stock_quantity=1)
+            ProductVariant.objects.create(product=self.product, size='M', color='Red', stock_quantity=0)
+
+    def test_matrix_contents(self):
+        matrix = self.product.variant_matrix()
+        self.assertEqual(matrix.sizes, ['S', 'L'])
+        self.assertEqual(matrix.colors, ['Blue', 'Red'])
+        self.assertEqual(matrix.valid_combinations, [
+            {'color': 'Blue', 'size': 'S'},
+            {'color': 'Red', 'size': 'L'},
+        ])
+        self.assertEqual(matrix.stock('M', 'Red'), 0)
+        self.assertTrue(matrix.in_stock)
+
+    def test_matrix_is_cached_until_a_variant_changes(self):
+        self.product.variant_matrix()
+        with self.assertNumQueries(0):
+            self.product.variant_matrix()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.variant.stock_quantity = 0
+            self.variant.save()
+        self.assertEqual(self.product.variant_matrix().sizes, ['S'])
+
+    def test_detail_page_renders_matrix(self):
+        response = self.client.get(reverse('products:detail', args=['tee']))
+        self.assertContains(response, 'Add to cart')
+        self.assertContains(response, '&quot;size&quot;: &quot;L&quot;')
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.category = Category.objects.create(name='Tops', slug='tops')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(
+                name='Tee', slug='tee', category=self.category, description='Test', base_price=10,
+            )
+
+    def test_card_fragment_follows_product_writes(self):
+        self.assertContains(self.client.get(reverse('products:shop')), 'Tee')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Long Sleeve Tee'
+            self.product.save()
+        self.assertContains(self.client.get(reverse('products:shop')), 'Long Sleeve Tee')
+
+    def test_nav_fragment_follows_category_writes(self):
+        self.assertContains(self.client.get(reverse('products:shop')), 'Tops')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Shirts'
+            self.category.save()
+        response = self.client.get(reverse('pages:about'))
+        self.assertContains(response, 'Shirts')
+
+    def test_hits_and_misses_are_counted(self):
+        # Two different pages, so the second is not served whole from the page cache
+        self.client.get(reverse('products:shop'))
+        self.client.get(reverse('products:category', args=['tops']))
+        fragment_stats.flush()
+        hits, misses = fragment_stats.snapshot()['product_card']
+        self.assertGreaterEqual(hits, 1)
+        self.assertGreaterEqual(misses, 1)
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tops = Category.objects.create(name='Tops', slug='tops', order=2)
+            self.shoes = Category.objects.create(name='Shoes', slug='shoes', order=1)
+            Category.objects.create(name='Hidden', slug='hidden', is_active=False)
+            self.tee = Product.objects.create(
+                name='Tee', slug='tee', category=self.tops, description='Test', base_price=10,
+            )
+
+    def test_tree_contents_and_counts(self):
+        nodes = category_tree.categories()
+        self.assertEqual([n.slug for n in nodes], ['shoes', 'tops'])
+        self.assertEqual([n.product_count for n in nodes], [0, 1])
+        with self.assertNumQueries(0):
+            category_tree.categories()
+
+    def test_tree_follows_product_writes(self):
+        category_tree.categories()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tee.is_active = False
+            self.tee.save()
+        self.assertEqual([n.product_count for n in category_tree.categories()], [0, 0])
+
+    def test_partials_do_not_load_the_tree(self):
+        category_tree.nodes = None
+        self.client.get(reverse('cart:count'))
+        self.assertIsNone(category_tree.nodes)
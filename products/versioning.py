@@ -0,0 +1,41 @@
+"""Version counters used to invalidate per-process caches.
+
+Counters live in the default cache so every worker sees the same value;
+configure a shared cache backend (Redis/Memcached) in production. A
+missing counter restarts from the current time in milliseconds, so a
+cache flush can never hand out a version that was already seen.
+"""
+import time
+
+from django.core.cache import cache
+
+CATALOG_VERSION = 'catalog'
+CATALOG_DELETES_VERSION = 'catalog-deletes'
+# Only category writes: the navbar category lists depend on nothing else
+CATALOG_STRUCTURE_VERSION = 'catalog-structure'
+
+
+def product_variants_version(product_id):
+    return f'product-variants:{product_id}'
+
+
+def _key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    version = cache.get(_key(name))
+    if version is None:
+        cache.add(_key(name), int(time.time() * 1000), timeout=None)
+        version = cache.get(_key(name))
+    return version
+
+
+def bump_version(name):
+    try:
+        return cache.incr(_key(name))
+    except ValueError:
+        # The counter was never set or got evicted
+        version = int(time.time() * 1000)
+        cache.set(_key(name), version, timeout=None)
+        return version
@@ -1,59 +1,114 @@
+import json
+
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse
-from .models import Product, Category, ProductVariant
-from django.db.models import Q
+from django.http import HttpResponse, Http404
+from core.page_cache import add_page_tags, cache_anonymous_page
+from .models import Product, ProductCard, Category, ProductVariant
+from .pagination import RANK_ORDERING, SORT_ORDERINGS, InvalidCursor, get_ordering, paginate, paginate_keys
+from .search import search_products
+from .autocomplete import suggestion_index
+from .facets import FACETS, facet_index, parse_selection
+from .category_tree import category_tree
+
+PRODUCTS_PER_PAGE = 24
+# Query parameters the shop reads: the facet filters, sort order and cursor
+SHOP_QUERY_PARAMS = tuple(param for param, _ in FACETS.values()) + ('sort', 'cursor')
+
+
+def _render_product_list(request, products, context, ordering, sort_keys=None):
+    """Render one keyset page of products as the full shop page or, for
+    HTMX infinite-scroll requests, as just the next slice of the grid.
+
+    With ``sort_keys`` (pk -> sort field values of every matching product)
+    the page is found in memory and only its rows are fetched."""
+    cursor = request.GET.get('cursor')
+    try:
+        if sort_keys is not None:
+            page = paginate_keys(products, ordering, sort_keys, cursor, PRODUCTS_PER_PAGE)
+        else:
+            page = paginate(products, ordering, cursor, PRODUCTS_PER_PAGE)
+    except InvalidCursor:
+        raise Http404("Invalid page")
 
+    next_page_url = None
+    if page.has_next:
+        params = request.GET.copy()
+        params['cursor'] = page.next_cursor
+        next_page_url = f"{request.path}?{params.urlencode()}"
+
+    context.update({
+        'products': page.object_list,
+        'page': page,
+        'next_page_url': next_page_url,
+    })
+    if cursor and request.headers.get('HX-Request'):
+        return render(request, 'components/product_grid_page.html', context)
+    return render(request, 'pages/shop.html', context)
+
+
+@cache_anonymous_page(query_params=SHOP_QUERY_PARAMS)
 def shop(request, category_slug=None):
     """Shop page view with filtering"""
     category = None
-    categories = Category.objects.filter(is_active=True)
-    products = Product.objects.filter(is_active=True)
+    categories = category_tree.categories()
+    products = ProductCard.objects.filter(is_active=True)
     
     if category_slug:
         category = get_object_or_404(Category, slug=category_slug)
         products = products.filter(category=category)
-        
-    # Sorting
+        add_page_tags(request, f'category:{category.id}')
+    else:
+        add_page_tags(request, 'shop')
+
+    # Facet counts and matches come from the in-memory bitsets
+    selection = parse_selection(request.GET)
+    facets = facet_index.select(category.id if category else None, selection)
+    # Filtered listings are paginated from the matches' in-memory sort keys
+    sort_keys = facets.sort_keys if selection else None
+
+    # Sorting is applied by the keyset paginator
     sort = request.GET.get('sort')
-    if sort == 'price_asc':
-        products = products.order_by('base_price')
-    elif sort == 'price_desc':
-        products = products.order_by('-base_price')
-    elif sort == 'newest':
-        products = products.order_by('-created_at')
+
+    filter_params = request.GET.copy()
+    for param in ('sort', 'cursor'):
+        filter_params.pop(param, None)
         
     context = {
         'category': category,
         'categories': categories,
-        'products': products,
         'current_sort': sort,
+        'facet_groups': facets.groups(),
+        'filters_active': bool(selection),
+        'filter_querystring': filter_params.urlencode(),
     }
-    return render(request, 'pages/shop.html', context)
+    return _render_product_list(request, products, context, get_ordering(sort), sort_keys)
 
+@cache_anonymous_page()
 def product_detail(request, slug):
     """Product detail view"""
-    product = get_object_or_404(Product, slug=slug, is_active=True)
-    
-    # Get available variants and valid combinations
-    variants = product.variants.filter(is_available=True, stock_quantity__gt=0)
-    sizes = variants.values_list('size', flat=True).distinct()
-    colors = variants.values_list('color', flat=True).distinct()
+    product = get_object_or_404(
+        Product.objects.select_related('category').prefetch_related('images'),
+        slug=slug, is_active=True,
+    )
+    # Related products come from the same category
+    add_page_tags(request, f'product:{product.pk}', f'category:{product.category_id}')
     
-    # Create a list of valid color/size combinations for Alpine.js
-    valid_combinations = list(variants.values('color', 'size'))
+    # Sizes, colors and valid combinations all come from one cached matrix
+    matrix = product.variant_matrix()
     
     # Related products (same category, exclude current)
-    related_products = Product.objects.filter(
-        category=product.category, 
+    related_products = ProductCard.objects.filter(
+        category_id=product.category_id, 
         is_active=True
-    ).exclude(id=product.id)[:4]
+    ).exclude(product=product)[:4]
     
     context = {
         'product': product,
-        'variants': variants,
-        'sizes': sizes,
-        'colors': colors,
-        'valid_combinations': valid_combinations,
+        'variant_matrix': matrix,
+        'sizes': matrix.sizes,
+        'colors': matrix.colors,
+        # JSON for Alpine.js, autoescaped into the x-data attribute
+        'valid_combinations': json.dumps(matrix.valid_combinations),
         'related_products': related_products,
     }
     return render(request, 'pages/product_detail.html', context)
@@ -61,21 +116,22 @@ def product_detail(request, slug):
 def search(request):
     """Full search results view"""
     query = request.GET.get('q', '')
-    products = Product.objects.filter(is_active=True)
+    products = ProductCard.objects.filter(is_active=True)
+    sort = request.GET.get('sort')
+    ordering = get_ordering(sort)
     
     if query:
-        products = products.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query)
-        ).distinct()
+        products = search_products(products, query)
+        # Best matches first unless the customer picked a sort order
+        if sort not in SORT_ORDERINGS:
+            ordering = RANK_ORDERING
     
     context = {
-        'products': products,
         'query': query,
-        'categories': Category.objects.filter(is_active=True),
+        'categories': category_tree.categories(),
+        'current_sort': sort,
     }
-    return render(request, 'pages/shop.html', context)
+    return _render_product_list(request, products, context, ordering)
 
 def search_suggestions(request):
     """Real-time search suggestions view (HTMX)"""
@@ -83,11 +139,7 @@ def search_suggestions(request):
     if len(query) < 2:
         return HttpResponse('')
         
-    products = Product.objects.filter(
-        is_active=True
-    ).filter(
-        Q(name__icontains=query) | 
-        Q(category__name__icontains=query)
-    ).distinct()[:5]
+    # Served from the per-process index, no database queries
+    products = suggestion_index.suggest(query, limit=5)
     
     return render(request, 'components/search_suggestions.html', {'products': products})